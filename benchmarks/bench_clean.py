@@ -0,0 +1,167 @@
+"""
+Benchmark clean_ibm_sandbox.clean() against the fake IBM Cloud in fake_ibm.py.
+
+For each scenario the fake is reset, one account is cleaned and the wall
+time, the API calls the fake served and the peak Python memory of the
+cleaner (tracemalloc) are recorded. The fake runs in its own process so
+neither its CPU time nor its allocations count against the cleaner.
+
+    python benchmarks/bench_clean.py --output before.json
+    python benchmarks/bench_clean.py --baseline before.json
+
+tracemalloc slows allocation-heavy code down, so compare wall times
+between runs of this script rather than against production timings.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tracemalloc
+import urllib.request
+from time import perf_counter
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+CLEANUP_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'cleanup')
+
+SCENARIOS = ['empty', 'instances-100', 'mixed-1000']
+
+
+def start_fake():
+    """Start fake_ibm.py in a subprocess and return (process, base URL)."""
+    process = subprocess.Popen([sys.executable, os.path.join(BENCHMARKS_DIR, 'fake_ibm.py')],
+                               stdout=subprocess.PIPE, text=True)
+    return process, process.stdout.readline().strip()
+
+
+def control(base_url, path, body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    request = urllib.request.Request(f"{base_url}/_bench/{path}", data=data, method='POST' if data else 'GET')
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+
+def point_cleaner_at(base_url):
+    """Route every IBM Cloud endpoint of the cleaner to the fake; must run before the cleaner is imported."""
+    os.environ.update({
+        'IBM_IAM_URL': base_url,
+        'IBM_CONTAINERS_URL': base_url,
+        'IBM_VPC_URL': f"{base_url}/v1",
+        'IBM_RESOURCE_CONTROLLER_URL': base_url,
+        'IBM_RESOURCE_MANAGER_URL': base_url,
+        # No Pushgateway, no checkpoints: only the cleanup itself is measured.
+        'PUSH_GATEWAY_URL': '',
+    })
+    os.environ.pop('CHECKPOINT_TABLE', None)
+    os.environ.pop('CHECKPOINT_DIR', None)
+    sys.path.insert(0, CLEANUP_DIR)
+
+
+def run(cleaner, base_url, scenario, run_number, fake_config, max_parallel_regions):
+    control(base_url, 'reset', dict(fake_config, scenario=scenario))
+    # A fresh API key per run so no token is reused from an earlier run.
+    account_name = f"bench-{scenario}-{run_number}"
+    tracemalloc.reset_peak()
+    start = perf_counter()
+    error = None
+    try:
+        left = cleaner.clean(f"key-{account_name}", max_parallel_regions=max_parallel_regions,
+                            account_name=account_name)
+    except Exception as e:
+        # With injected failures a cleanup may give up; that is a result too.
+        left, error = None, repr(e)
+    wall = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    stats = control(base_url, 'stats')
+    return {
+        'scenario': scenario,
+        'run': run_number,
+        'wall_seconds': round(wall, 3),
+        'api_calls': stats['total_calls'],
+        'peak_memory_mb': round(peak / 2 ** 20, 2),
+        'resource_instances_left': len(left or []),
+        'resources_left': stats['remaining'],
+        'failures_injected': stats['failures_injected'],
+        'error': error,
+        'calls': stats['calls'],
+    }
+
+
+def compare(results, baseline):
+    """Print each result next to the matching baseline result."""
+    old = {(result['scenario'], result['run']): result for result in baseline}
+    print(f"{'scenario':<14} {'run':>3} {'wall s':>16} {'API calls':>16} {'peak MB':>16}")
+    for result in results:
+        before = old.get((result['scenario'], result['run']))
+        columns = []
+        for key in ('wall_seconds', 'api_calls', 'peak_memory_mb'):
+            value = result[key]
+            if before and before[key]:
+                columns.append(f"{value:>8} ({(value - before[key]) / before[key]:+.0%})")
+            else:
+                columns.append(f"{value:>16}")
+        print(f"{result['scenario']:<14} {result['run']:>3} {' '.join(columns)}")
+
+
+def main(scenarios, repeat=1, max_parallel_regions=4, fake_config=None, deadline_scale=1.0,
+         output=None, baseline=None):
+    process, base_url = start_fake()
+    try:
+        point_cleaner_at(base_url)
+        import clean_ibm_sandbox
+        # Resources that never go away otherwise keep the cleaner waiting for the production deadlines.
+        for resource_type, deadline in clean_ibm_sandbox.WAIT_DEADLINES.items():
+            clean_ibm_sandbox.WAIT_DEADLINES[resource_type] = deadline * deadline_scale
+
+        tracemalloc.start()
+        results = []
+        for scenario in scenarios:
+            for run_number in range(1, repeat + 1):
+                result = run(clean_ibm_sandbox, base_url, scenario, run_number, fake_config or {}, max_parallel_regions)
+                print(f"{scenario} run {run_number}: {result['wall_seconds']}s, {result['api_calls']} API calls, "
+                      f"{result['peak_memory_mb']} MB peak{', failed: ' + result['error'] if result['error'] else ''}",
+                      file=sys.stderr)
+                results.append(result)
+        tracemalloc.stop()
+    finally:
+        process.terminate()
+        process.wait()
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if baseline:
+        with open(baseline) as f:
+            compare(results, json.load(f))
+    else:
+        compare(results, [])
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Benchmark the IBM sandbox cleaner against a fake IBM Cloud.")
+    parser.add_argument("--scenario", action='append', choices=SCENARIOS,
+                        help="Scenario to run; may be repeated. Defaults to all of them.")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per scenario.")
+    parser.add_argument("--max-parallel-regions", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds the fake takes per request.")
+    parser.add_argument("--deletion-delay", type=float, default=0.5,
+                        help="Seconds a deleted resource stays listed as deleting.")
+    parser.add_argument("--page-size", type=int, default=50, help="Largest page the fake returns.")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="Share of requests the fake fails with a 503.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--deadline-scale", type=float, default=1.0,
+                        help="Factor applied to the cleaner's deletion deadlines.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare against.")
+    parser.add_argument("--verbose", action='store_true', help="Show the cleaner's own logs.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    fake_config = {'latency': args.latency, 'deletion_delay': args.deletion_delay, 'page_size': args.page_size,
+                   'failure_rate': args.failure_rate, 'seed': args.seed}
+    main(args.scenario or SCENARIOS, args.repeat, args.max_parallel_regions, fake_config,
+         args.deadline_scale, args.output, args.baseline)
@@ -0,0 +1,155 @@
+"""
+Benchmark the verify and update-billing jobs against the stand-ins in fake_backends.py.
+
+Runs app.verify_accounts() and update-billing's main() for a fleet of
+N sandbox accounts with hours of billing history and reports accounts
+per second, DynamoDB read and write unit estimates and Pushgateway
+pushes (metrics are flushed after each run, as the jobs do at exit).
+
+    python benchmarks/bench_pipelines.py --accounts 2000 --output before.json
+    python benchmarks/bench_pipelines.py --accounts 2000 --baseline before.json
+"""
+import argparse
+import importlib
+import json
+import logging
+import os
+import subprocess
+import sys
+from contextlib import redirect_stdout
+from time import perf_counter
+
+from bench_clean import BENCHMARKS_DIR, CLEANUP_DIR, control
+
+PIPELINES = ['verify', 'billing']
+BILLING_TABLE = 'sandbox_billing'
+
+
+def start_fake():
+    process = subprocess.Popen([sys.executable, os.path.join(BENCHMARKS_DIR, 'fake_backends.py'), '--accounts', '0'],
+                               stdout=subprocess.PIPE, text=True)
+    return process, process.stdout.readline().strip()
+
+
+def point_jobs_at(base_url, delta_mode=False):
+    """Route SAA, DynamoDB, IAM, the enterprise APIs and the Pushgateway to the fake; must run before importing."""
+    os.environ.update({
+        'SAA_URL': f"{base_url}/saa",
+        'DYNAMODB_ENDPOINT_URL': base_url,
+        'AWS_ACCESS_KEY_ID': 'bench',
+        'AWS_SECRET_ACCESS_KEY': 'bench',
+        'AWS_REGION': 'us-east-1',
+        'IBM_USAGE_DB': BILLING_TABLE,
+        'BILLING_TABLE': BILLING_TABLE,
+        'BILLING_DELTA_MODE': 'true' if delta_mode else 'false',
+        'ENTERPRISE_API_KEY': 'bench',
+        'ENTERPRISE_ACCOUNT_ID': 'bench-enterprise',
+        'IBM_IAM_URL': base_url,
+        'IBM_ENTERPRISE_MANAGEMENT_URL': f"{base_url}/v1",
+        'IBM_ENTERPRISE_USAGE_REPORTS_URL': base_url,
+        'PUSH_GATEWAY_URL': base_url,
+    })
+    os.environ.pop('BILLING_COST_CACHE', None)
+    os.environ.pop('PUSH_INTERVAL_SECONDS', None)
+    sys.path.insert(0, CLEANUP_DIR)
+
+
+def run(pipeline, job, base_url, run_number, fake_config):
+    control(base_url, 'reset', dict(fake_config, table=BILLING_TABLE))
+    start = perf_counter()
+    # update-billing prints a line per account; keep it off the terminal.
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        if pipeline == 'verify':
+            job.verify_accounts(f"saa-key-{run_number}", os.environ['SAA_URL'])
+        else:
+            job.main()
+    wall = perf_counter() - start
+    from metrics import AppMetrics
+    AppMetrics.flush_metrics()
+    stats = control(base_url, 'stats')
+    accounts = fake_config['accounts']
+    return {
+        'pipeline': pipeline,
+        'run': run_number,
+        'accounts': accounts,
+        'wall_seconds': round(wall, 3),
+        'accounts_per_second': round(accounts / wall, 1) if wall else None,
+        'read_units': stats['read_units'],
+        'write_units': stats['write_units'],
+        'pushes': stats['total_pushes'],
+        'released': stats['released'],
+        'api_calls': stats['total_calls'],
+        'calls': stats['calls'],
+    }
+
+
+def compare(results, baseline):
+    old = {(result['pipeline'], result['run']): result for result in baseline}
+    keys = ('accounts_per_second', 'read_units', 'write_units', 'pushes', 'api_calls')
+    print(f"{'pipeline':<8} {'run':>3} {'accounts/s':>16} {'RCU':>16} {'WCU':>16} {'pushes':>16} {'API calls':>16}")
+    for result in results:
+        before = old.get((result['pipeline'], result['run']))
+        columns = []
+        for key in keys:
+            value = result[key]
+            if before and before[key]:
+                columns.append(f"{value:>8} ({(value - before[key]) / before[key]:+.0%})")
+            else:
+                columns.append(f"{value:>16}")
+        print(f"{result['pipeline']:<8} {result['run']:>3} {' '.join(columns)}")
+
+
+def main(pipelines, repeat=1, fake_config=None, delta_mode=False, output=None, baseline=None):
+    process, base_url = start_fake()
+    try:
+        point_jobs_at(base_url, delta_mode)
+        jobs = {'verify': importlib.import_module('app'), 'billing': importlib.import_module('update-billing')}
+        results = []
+        for pipeline in pipelines:
+            for run_number in range(1, repeat + 1):
+                result = run(pipeline, jobs[pipeline], base_url, run_number, fake_config or {})
+                print(f"{pipeline} run {run_number}: {result['accounts_per_second']} accounts/s, "
+                      f"{result['read_units']} RCU, {result['write_units']} WCU, {result['pushes']} pushes",
+                      file=sys.stderr)
+                results.append(result)
+    finally:
+        process.terminate()
+        process.wait()
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    baseline_results = []
+    if baseline:
+        with open(baseline) as f:
+            baseline_results = json.load(f)
+    compare(results, baseline_results)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Benchmark the verify and update-billing jobs against local stand-ins.")
+    parser.add_argument("--pipeline", action='append', choices=PIPELINES,
+                        help="Pipeline to run; may be repeated. Defaults to both.")
+    parser.add_argument("--accounts", type=int, default=2000, help="Sandbox accounts in the fleet.")
+    parser.add_argument("--account-groups", type=int, default=10)
+    parser.add_argument("--history-hours", type=int, default=48, help="Hours of billing history per account.")
+    parser.add_argument("--changed-share", type=float, default=0.1,
+                        help="Share of accounts whose cost rose in the last hour.")
+    parser.add_argument("--latency", type=float, default=0.005, help="Seconds the fakes take per request.")
+    parser.add_argument("--unprocessed-rate", type=float, default=0.0,
+                        help="Share of billing puts DynamoDB returns as unprocessed.")
+    parser.add_argument("--delta-mode", action='store_true', help="Run update-billing with BILLING_DELTA_MODE.")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per pipeline.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare against.")
+    parser.add_argument("--verbose", action='store_true', help="Show the jobs' own logs.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    fake_config = {'accounts': args.accounts, 'account_groups': args.account_groups,
+                   'history_hours': args.history_hours, 'changed_share': args.changed_share,
+                   'latency': args.latency, 'unprocessed_rate': args.unprocessed_rate, 'seed': args.seed}
+    main(args.pipeline or PIPELINES, args.repeat, fake_config, args.delta_mode, args.output, args.baseline)
@@ -0,0 +1,331 @@
+"""
+Local stand-ins for the backends of the verify and update-billing jobs.
+
+One process serves:
+
+    /saa/...                    the sandbox assignment API (token, cleanup and release lists)
+    / with X-Amz-Target         DynamoDB Query and BatchWriteItem (JSON protocol)
+    /metrics/job/...            a Pushgateway that only counts pushes
+    /identity/token             IAM
+    /v1/account-groups          enterprise management
+    /v1/resource-usage-reports  enterprise usage reports
+
+The state is seeded with N sandbox accounts, hours of hourly billing
+history and a usage report entry per account, and reset between runs
+through the /_bench control endpoints (see fake_ibm.py). DynamoDB read
+and write units are estimated the way DynamoDB bills them: a query
+costs half a unit per started 4 KB of items read, a put one unit per
+started 1 KB of item.
+
+    python benchmarks/fake_backends.py --port 8081 --accounts 2000
+"""
+import argparse
+import bisect
+import json
+import math
+import random
+import re
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from fake_ibm import error, iam_token
+
+DEFAULT_CONFIG = {
+    'accounts': 2000,
+    'account_groups': 10,
+    'history_hours': 48,
+    'table': 'sandbox_billing',
+    # Share of accounts whose cost went up in the last billing hour and
+    # so must not be released.
+    'changed_share': 0.1,
+    # Seconds added to every request.
+    'latency': 0.005,
+    # Largest page of usage report entries.
+    'page_size': 100,
+    # Share of BatchWriteItem puts returned as UnprocessedItems.
+    'unprocessed_rate': 0.0,
+    'seed': 0,
+}
+
+KEY_CONDITION = re.compile(r'^(\S+) = (:\w+)(?: AND (\S+) BETWEEN (:\w+) AND (:\w+))?$')
+FORM_FIELD = re.compile(rb'name="([^"]+)"\r\n\r\n([^\r]*)\r\n')
+
+
+def account_name(i):
+    return f"sandbox{i:05d}"
+
+
+def billing_timestamp(time):
+    # Records are written at a quarter past every hour, as by the CronJob.
+    return time.replace(minute=15, second=0, microsecond=0).isoformat('T', 'minutes')
+
+
+def item_size(item):
+    """Approximate DynamoDB item size: attribute names plus values."""
+    return sum(len(name) + len(next(iter(value.values()))) for name, value in item.items())
+
+
+class FakeBackends:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self, **config):
+        with self.lock:
+            self.config = dict(DEFAULT_CONFIG, **config)
+            self.random = random.Random(self.config['seed'])
+            self.calls = {}
+            self.pushes = {}
+            self.read_units = 0
+            self.write_units = 0
+            self.released = set()
+            # table -> account -> sorted [(timestamp, item)]
+            self.tables = {}
+            self.seed()
+
+    def seed(self):
+        now = datetime.now(timezone.utc)
+        count = self.config['accounts']
+        changed = set(self.random.sample(range(count), int(count * self.config['changed_share'])))
+        self.costs = {}
+        self.sandboxes = []
+        for i in range(count):
+            name = account_name(i)
+            cost = round(self.random.uniform(0, 50), 2)
+            history = []
+            for hours in range(self.config['history_hours'], -1, -1):
+                time = now - timedelta(hours=hours)
+                if time.minute < 15:
+                    time -= timedelta(hours=1)
+                # Changed accounts picked up cost in the last billing hour.
+                billed = cost + 1 if i in changed and hours == 0 else cost
+                history.append((billing_timestamp(time), {
+                    'account_name': {'S': name}, 'timestamp': {'S': billing_timestamp(time)},
+                    'billable_cost': {'N': str(billed)}, 'account_id': {'S': f"id-{name}"},
+                    'cloud_provider': {'S': 'ibm'}, 'billing_month': {'S': time.strftime('%Y-%m')},
+                    'ttl': {'N': str((time + timedelta(days=61)).timestamp())}}))
+            self.tables.setdefault(self.config['table'], {})[name] = sorted(dict(history).items())
+            self.costs[name] = cost + 1 if i in changed else cost
+            self.sandboxes.append({'account_name': {'S': name}, 'cloud_provider': {'S': 'ibm'},
+                                   'cleanup_time': {'S': (now - timedelta(hours=9)).isoformat()}})
+
+    def count(self, operation):
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {'calls': dict(sorted(self.calls.items())), 'total_calls': sum(self.calls.values()),
+                    'pushes': dict(sorted(self.pushes.items())), 'total_pushes': sum(self.pushes.values()),
+                    'read_units': self.read_units, 'write_units': self.write_units,
+                    'released': len(self.released)}
+
+    # DynamoDB
+
+    def query(self, request):
+        names = request.get('ExpressionAttributeNames', {})
+        values = request.get('ExpressionAttributeValues', {})
+        match = KEY_CONDITION.match(request['KeyConditionExpression'])
+        if not match:
+            return 400, {'__type': 'com.amazon.coral.validate#ValidationException',
+                         'message': 'Unsupported key condition'}
+        hash_value = values[match.group(2)]['S']
+        low, high = (values[match.group(4)]['S'], values[match.group(5)]['S']) if match.group(3) else (None, None)
+        with self.lock:
+            records = self.tables.get(request['TableName'], {}).get(hash_value, [])
+            timestamps = [timestamp for timestamp, _ in records]
+            first = bisect.bisect_left(timestamps, low) if low is not None else 0
+            last = bisect.bisect_right(timestamps, high) if high is not None else len(records)
+            selected = records[first:last]
+            if not request.get('ScanIndexForward', True):
+                selected = selected[::-1]
+            start_key = request.get('ExclusiveStartKey')
+            if start_key:
+                start = start_key['timestamp']['S']
+                selected = [record for record in selected
+                            if (record[0] < start if not request.get('ScanIndexForward', True) else record[0] > start)]
+            limit = request.get('Limit')
+            page = selected[:limit] if limit else selected
+            size = sum(item_size(item) for _, item in page)
+            self.read_units += max(1, math.ceil(size / 4096)) * 0.5
+        items = [item for _, item in page]
+        if request.get('ProjectionExpression'):
+            attributes = [names.get(name.strip(), name.strip()) for name in request['ProjectionExpression'].split(',')]
+            items = [{name: item[name] for name in attributes if name in item} for item in items]
+        result = {'Items': items, 'Count': len(items), 'ScannedCount': len(items)}
+        if limit and len(selected) > limit:
+            result['LastEvaluatedKey'] = {'account_name': {'S': hash_value}, 'timestamp': page[-1][1]['timestamp']}
+        return 200, result
+
+    def batch_write_item(self, request):
+        unprocessed = {}
+        with self.lock:
+            for table, requests in request['RequestItems'].items():
+                if len(requests) > 25:
+                    return 400, {'__type': 'com.amazon.coral.validate#ValidationException',
+                                 'message': 'Too many items requested for the BatchWriteItem call'}
+                for put in requests:
+                    if self.random.random() < self.config['unprocessed_rate']:
+                        unprocessed.setdefault(table, []).append(put)
+                        continue
+                    item = put['PutRequest']['Item']
+                    records = self.tables.setdefault(table, {}).setdefault(item['account_name']['S'], [])
+                    timestamp = item['timestamp']['S']
+                    position = bisect.bisect_left([record[0] for record in records], timestamp)
+                    if position < len(records) and records[position][0] == timestamp:
+                        records[position] = (timestamp, item)
+                    else:
+                        records.insert(position, (timestamp, item))
+                    self.write_units += max(1, math.ceil(item_size(item) / 1024))
+        return 200, {'UnprocessedItems': unprocessed}
+
+    # SAA
+
+    def release(self, body):
+        fields = parse_form(body)
+        with self.lock:
+            self.released.add(fields.get('account_name'))
+        return 200, {'message': 'released'}
+
+    # Enterprise
+
+    def account_groups(self):
+        return 200, {'rows_count': self.config['account_groups'], 'next_url': None,
+                     'resources': [{'id': f"ag-{i:03d}", 'name': f"group-{i:03d}"}
+                                   for i in range(self.config['account_groups'])]}
+
+    def usage_report(self, query, url):
+        groups = self.config['account_groups']
+        group = int(query['account_group_id'].split('-')[1])
+        names = [account_name(i) for i in range(group, self.config['accounts'], groups)]
+        offset = int(query.get('offset') or 0)
+        limit = min(int(query.get('limit') or 30), self.config['page_size'])
+        reports = [{'entity_id': f"id-{name}", 'entity_type': 'account', 'entity_name': name,
+                    'entity_crn': f"crn:v1:bluemix:public:enterprise::a/{name}::account:{name}",
+                    'billing_country': 'USA', 'currency_code': 'USD', 'month': query.get('month'),
+                    'billable_cost': self.costs[name], 'non_billable_cost': 0, 'billable_rated_cost': self.costs[name],
+                    'non_billable_rated_cost': 0, 'resources': []}
+                   for name in names[offset:offset + limit]]
+        result = {'limit': limit, 'first': {'href': url}, 'reports': reports}
+        if offset + limit < len(names):
+            next_offset = str(offset + limit)
+            result['next'] = {'href': f"{url}?{urlencode(dict(query, offset=next_offset))}", 'offset': next_offset}
+        return 200, result
+
+
+def parse_form(body):
+    """Pull the fields out of the multipart/form-data body urllib3 sends for fields=."""
+    return {name.decode(): value.decode() for name, value in FORM_FIELD.findall(body)}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def dispatch(self, method):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        if parts[0] == '_bench':
+            if parts[1:] == ['reset']:
+                fake.reset(**json.loads(body or b'{}'))
+                return self.reply(200, {'status': 'ok'})
+            return self.reply(200, fake.stats())
+
+        target = self.headers.get('X-Amz-Target')
+        if target:
+            operation = target.split('.')[-1]
+            fake.count(f"dynamodb.{operation}")
+            self.delay()
+            handlers = {'Query': fake.query, 'BatchWriteItem': fake.batch_write_item}
+            if operation not in handlers:
+                return self.reply(400, {'__type': 'com.amazonaws.dynamodb.v20120810#UnknownOperationException'},
+                                  'application/x-amz-json-1.0')
+            return self.reply(*handlers[operation](json.loads(body)), 'application/x-amz-json-1.0')
+
+        if parts[:2] == ['metrics', 'job']:
+            with fake.lock:
+                fake.pushes[parts[2]] = fake.pushes.get(parts[2], 0) + 1
+            return self.reply(200, None)
+
+        operation, handle = self.route(method, parts, query, f"http://{self.headers['Host']}{url.path}", body)
+        fake.count(operation)
+        self.delay()
+        if handle is None:
+            return self.reply(404, error('not_found', f"{method} {url.path} not found"))
+        self.reply(*handle())
+
+    def route(self, method, parts, query, url, body):
+        fake = self.server.fake
+        if parts[:2] == ['identity', 'token']:
+            return 'iam.token', lambda: (200, iam_token())
+        if parts[:2] == ['saa', 'token']:
+            return 'saa.token', lambda: (200, {'access_token': 'saa-token', 'expires_in': 3600})
+        if parts[:2] == ['saa', 'sandbox'] and len(parts) == 3:
+            if method == 'GET':
+                listing = fake.sandboxes if parts[2] == 'release' else []
+                return f"saa.get_{parts[2]}", lambda: (200, listing)
+            if parts[2] == 'release':
+                return 'saa.release', lambda: fake.release(body)
+            return f"saa.update_{parts[2]}", lambda: (200, {'message': 'updated'})
+        if parts == ['v1', 'account-groups']:
+            return 'enterprise.list_account_groups', fake.account_groups
+        if parts == ['v1', 'resource-usage-reports']:
+            return 'enterprise.get_resource_usage_report', lambda: fake.usage_report(query, url)
+        return f"unknown {method}", None
+
+    def delay(self):
+        if self.server.fake.config['latency']:
+            sleep(self.server.fake.config['latency'])
+
+    def reply(self, status, body, content_type='application/json'):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeBackendsServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+    def __init__(self, address):
+        super().__init__(address, Handler)
+        self.fake = FakeBackends()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Serve fake SAA, DynamoDB, Pushgateway and enterprise APIs.")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=0,
+                        help="Port to listen on; 0 picks a free one.")
+    parser.add_argument("--accounts", type=int, default=DEFAULT_CONFIG['accounts'],
+                        help="Sandbox accounts to seed before the first reset.")
+    args = parser.parse_args()
+
+    server = FakeBackendsServer((args.host, args.port))
+    server.fake.reset(accounts=args.accounts)
+    print(f"http://{args.host}:{server.server_address[1]}", flush=True)
+    server.serve_forever()
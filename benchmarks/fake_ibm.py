@@ -0,0 +1,424 @@
+"""
+Local stand-in for the IBM Cloud APIs used by the cleaner.
+
+Serves IAM, VPC (global and regional endpoints), resource controller,
+resource manager and containers from one process, with configurable
+latency, deletion delays, page sizes and injected failures. The state is
+seeded from a named scenario and reset between benchmark runs through
+the /_bench control endpoints:
+
+    POST /_bench/reset   {"scenario": "mixed-1000", "latency": 0.02, ...}
+    GET  /_bench/stats   call counts and the resources left over
+
+Run it on its own to point the cleaner at it by hand:
+
+    python benchmarks/fake_ibm.py --port 8080 --scenario mixed-1000
+"""
+import argparse
+import bisect
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep, time
+from urllib.parse import parse_qs, unquote, urlencode, urlparse
+
+import jwt
+
+DEFAULT_CONFIG = {
+    # Seconds added to every request, +/- latency_jitter of it.
+    'latency': 0.02,
+    'latency_jitter': 0.5,
+    # Seconds a resource stays listed in its deleting state after a delete.
+    'deletion_delay': 0.5,
+    'cluster_deletion_delay': 3,
+    # Largest page any list call returns, whatever limit it asks for.
+    'page_size': 50,
+    # Probability of answering a (non-IAM) request with a 503.
+    'failure_rate': 0.0,
+    'seed': 0,
+}
+
+REGIONS = ['us-south', 'us-east', 'eu-de', 'eu-gb', 'eu-es', 'jp-tok', 'jp-osa', 'au-syd', 'br-sao', 'ca-mon']
+RESOURCE_GROUP = 'rg-bench'
+ACCOUNT_ID = 'bench-account'
+
+# URL collection -> (result key, status field, normal state, deleting state)
+VPC_COLLECTIONS = {
+    'instance_groups': ('instance_groups', 'status', 'healthy', 'deleting'),
+    'instance/templates': ('templates', None, None, None),
+    'instances': ('instances', 'status', 'running', 'deleting'),
+    'volumes': ('volumes', 'status', 'available', 'pending_deletion'),
+    'keys': ('keys', None, None, None),
+    'images': ('images', 'status', 'available', 'deleting'),
+    'vpn_gateways': ('vpn_gateways', 'status', 'available', 'deleting'),
+    'load_balancers': ('load_balancers', 'provisioning_status', 'active', 'delete_pending'),
+    'endpoint_gateways': ('endpoint_gateways', 'lifecycle_state', 'stable', 'deleting'),
+    'subnets': ('subnets', 'status', 'available', 'deleting'),
+    'public_gateways': ('public_gateways', 'status', 'available', 'deleting'),
+    'floating_ips': ('floating_ips', 'status', 'available', 'deleting'),
+    'vpcs': ('vpcs', 'status', 'available', 'deleting'),
+    'security_groups': ('security_groups', None, None, None),
+    'flow_log_collectors': ('flow_log_collectors', 'lifecycle_state', 'stable', 'deleting'),
+}
+
+# Resources per region of the mixed scenario, 100 per region.
+MIXED_REGION = {
+    'instances': 20, 'volumes': 20, 'floating_ips': 10, 'keys': 10, 'subnets': 10, 'security_groups': 10,
+    'images': 5, 'public_gateways': 5, 'vpcs': 5, 'load_balancers': 2, 'vpn_gateways': 1,
+    'endpoint_gateways': 1, 'instance/templates': 1,
+}
+
+SCENARIOS = {
+    # Nothing to delete anywhere: the cost of just looking.
+    'empty': {},
+    # 100 instances in one VPC of a single region.
+    'instances-100': {
+        'regions': {'us-south': {'instances': 100, 'vpcs': 1, 'subnets': 1, 'security_groups': 1}},
+    },
+    # 1000 resources of every kind spread over 10 regions, plus RHOIC
+    # clusters and object storage instances.
+    'mixed-1000': {
+        'regions': {region: MIXED_REGION for region in REGIONS},
+        'clusters': ['us-south', 'eu-de'],
+        'cos_instances': 5,
+    },
+}
+
+
+def build_state(scenario):
+    """Return the seeded resources of a scenario."""
+    spec = SCENARIOS[scenario]
+    vpc = {region: {collection: {} for collection in VPC_COLLECTIONS} for region in REGIONS}
+    resource_instances = {}
+    for region, counts in spec.get('regions', {}).items():
+        for collection, count in counts.items():
+            key, status_key, state, _ = VPC_COLLECTIONS[collection]
+            for i in range(count):
+                resource_id = f"{region}-{key}-{i:05d}"
+                crn = f"crn:v1:bluemix:public:is:{region}:a/{ACCOUNT_ID}::{key}:{resource_id}"
+                item = {'id': resource_id, 'crn': crn, 'name': resource_id,
+                        'vpc': {'id': f"{region}-vpcs-00000"}, 'resource_group': {'id': RESOURCE_GROUP}}
+                if status_key:
+                    item[status_key] = state
+                vpc[region][collection][resource_id] = item
+                if collection == 'instances':
+                    # The resource controller mirrors VPC instances until they are gone.
+                    resource_instances[crn] = {'id': crn, 'crn': crn, 'guid': resource_id, 'name': resource_id,
+                                               'resource_group_id': RESOURCE_GROUP, 'resource_id': 'is.instance',
+                                               'state': 'active', '_vpc': (region, collection, resource_id)}
+    for i in range(spec.get('cos_instances', 0)):
+        crn = f"crn:v1:bluemix:public:cloud-object-storage:global:a/{ACCOUNT_ID}:cos-{i:05d}::"
+        resource_instances[crn] = {'id': crn, 'crn': crn, 'guid': f"cos-{i:05d}", 'name': f"cos-{i:05d}",
+                                   'resource_group_id': RESOURCE_GROUP, 'resource_id': 'cloud-object-storage',
+                                   'state': 'active'}
+    clusters = {f"cluster-{i:03d}": {'id': f"cluster-{i:03d}", 'name': f"cluster-{i:03d}", 'region': region,
+                                     'state': 'normal'}
+                for i, region in enumerate(spec.get('clusters', []))}
+    return vpc, resource_instances, clusters
+
+
+class FakeIBM:
+    """State and counters of the fake APIs, shared by all request threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset('empty')
+
+    def reset(self, scenario, **config):
+        with self.lock:
+            self.config = dict(DEFAULT_CONFIG, **config)
+            self.random = random.Random(self.config['seed'])
+            self.vpc, self.resource_instances, self.clusters = build_state(scenario)
+            # (kind, key) -> monotonic time the deleted resource disappears
+            self.deleting = {}
+            self.calls = {}
+            self.failures = 0
+
+    def count(self, operation):
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def delay(self):
+        latency = self.config['latency']
+        if latency:
+            jitter = latency * self.config['latency_jitter']
+            sleep(max(0, self.random.uniform(latency - jitter, latency + jitter)))
+
+    def should_fail(self):
+        with self.lock:
+            if self.random.random() < self.config['failure_rate']:
+                self.failures += 1
+                return True
+        return False
+
+    def purge(self):
+        """Drop the resources whose deletion delay has passed. Called with the lock held."""
+        now = monotonic()
+        for (kind, key), gone_at in list(self.deleting.items()):
+            if gone_at > now:
+                continue
+            del self.deleting[(kind, key)]
+            if kind == 'vpc':
+                region, collection, resource_id = key
+                item = self.vpc[region][collection].pop(resource_id, None)
+                if item:
+                    self.resource_instances.pop(item['crn'], None)
+            elif kind == 'rc':
+                self.resource_instances.pop(key, None)
+            else:
+                self.clusters.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            self.purge()
+            remaining = {}
+            for collections in self.vpc.values():
+                for collection, items in collections.items():
+                    if items:
+                        remaining[collection] = remaining.get(collection, 0) + len(items)
+            if self.resource_instances:
+                remaining['resource_instances'] = len(self.resource_instances)
+            if self.clusters:
+                remaining['clusters'] = len(self.clusters)
+            return {'calls': dict(sorted(self.calls.items())), 'total_calls': sum(self.calls.values()),
+                    'failures_injected': self.failures, 'remaining': remaining}
+
+    # VPC
+
+    def list_regions(self, base_url):
+        return 200, {'regions': [{'name': region, 'endpoint': f"{base_url}/regions/{region}", 'status': 'available'}
+                                 for region in REGIONS]}
+
+    def list_vpc(self, region, collection, query, url):
+        key = VPC_COLLECTIONS[collection][0]
+        with self.lock:
+            self.purge()
+            items = self.vpc[region][collection]
+            if collection == 'images' and query.get('visibility') != 'private':
+                # Only private images belong to the account.
+                items = {}
+            ids = sorted(items)
+            start = bisect.bisect_left(ids, query['start']) if query.get('start') else 0
+            limit = min(int(query.get('limit') or 50), self.config['page_size'])
+            page = [items[resource_id] for resource_id in ids[start:start + limit]]
+            result = {key: page, 'limit': limit, 'total_count': len(ids), 'first': {'href': url}}
+            if start + limit < len(ids):
+                result['next'] = {'href': f"{url}?{urlencode(dict(query, start=ids[start + limit]))}"}
+        return 200, result
+
+    def delete_vpc(self, region, collection, resource_id):
+        _, status_key, _, deleting_state = VPC_COLLECTIONS[collection]
+        with self.lock:
+            self.purge()
+            item = self.vpc[region][collection].get(resource_id)
+            if item is None:
+                return 404, error('not_found', f"{collection} {resource_id} not found")
+            if status_key:
+                item[status_key] = deleting_state
+            self.deleting.setdefault(('vpc', (region, collection, resource_id)),
+                                     monotonic() + self.config['deletion_delay'])
+        return 204, None
+
+    def update_instance_group(self, region, resource_id):
+        with self.lock:
+            item = self.vpc[region]['instance_groups'].get(resource_id)
+        if item is None:
+            return 404, error('not_found', f"instance group {resource_id} not found")
+        return 200, item
+
+    # Resource controller
+
+    def rc_view(self, instance):
+        """The instance as the API returns it, tracking its VPC counterpart. Called with the lock held."""
+        if '_vpc' in instance:
+            region, collection, resource_id = instance['_vpc']
+            item = self.vpc[region][collection].get(resource_id)
+            if item is None:
+                return None
+            state = 'pending_removal' if ('vpc', instance['_vpc']) in self.deleting else 'active'
+            return {key: value for key, value in instance.items() if key != '_vpc'} | {'state': state}
+        return dict(instance)
+
+    def list_resource_instances(self, query):
+        with self.lock:
+            self.purge()
+            views = [self.rc_view(instance) for crn, instance in sorted(self.resource_instances.items())
+                     if instance['resource_group_id'] == query.get('resource_group_id', RESOURCE_GROUP)]
+            views = [view for view in views if view]
+            ids = [view['id'] for view in views]
+            start = bisect.bisect_left(ids, query['start']) if query.get('start') else 0
+            limit = min(int(query.get('limit') or 100), self.config['page_size'])
+            result = {'rows_count': len(views[start:start + limit]), 'resources': views[start:start + limit],
+                      'next_url': None}
+            if start + limit < len(ids):
+                result['next_url'] = f"/v2/resource_instances?{urlencode(dict(query, start=ids[start + limit]))}"
+        return 200, result
+
+    def get_resource_instance(self, crn):
+        with self.lock:
+            self.purge()
+            instance = self.resource_instances.get(crn)
+            view = self.rc_view(instance) if instance else None
+        if view is None:
+            return 404, error('not_found', f"resource instance {crn} not found")
+        return 200, view
+
+    def delete_resource_instance(self, crn):
+        with self.lock:
+            self.purge()
+            instance = self.resource_instances.get(crn)
+            if instance is None:
+                return 404, error('not_found', f"resource instance {crn} not found")
+            instance['state'] = 'pending_removal'
+            self.deleting.setdefault(('rc', crn), monotonic() + self.config['deletion_delay'])
+        return 204, None
+
+    # Containers
+
+    def list_clusters(self):
+        with self.lock:
+            self.purge()
+            return 200, [dict(cluster) for cluster in self.clusters.values()]
+
+    def delete_cluster(self, cluster_id):
+        with self.lock:
+            cluster = self.clusters.get(cluster_id)
+            if cluster is None:
+                return 404, error('not_found', f"cluster {cluster_id} not found")
+            cluster['state'] = 'deleting'
+            self.deleting.setdefault(('cluster', cluster_id), monotonic() + self.config['cluster_deletion_delay'])
+        return 202, None
+
+
+def error(code, message):
+    return {'errors': [{'code': code, 'message': message}], 'status_code': 0}
+
+
+def iam_token():
+    now = int(time())
+    token = jwt.encode({'iat': now, 'exp': now + 3600, 'account': {'bss': ACCOUNT_ID}}, 'fake-ibm-benchmark-signing-key-000', algorithm='HS256')
+    return {'access_token': token, 'refresh_token': 'not-used', 'token_type': 'Bearer', 'expires_in': 3600,
+            'expiration': now + 3600}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_PATCH(self):
+        self.dispatch('PATCH')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def dispatch(self, method):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')]
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        if parts[0] == '_bench':
+            if parts[1:] == ['reset']:
+                config = json.loads(body or b'{}')
+                fake.reset(config.pop('scenario', 'empty'), **config)
+                return self.reply(200, {'status': 'ok'})
+            return self.reply(200, fake.stats())
+
+        operation, handle = self.route(method, parts, query, url.path)
+        fake.count(operation)
+        fake.delay()
+        if handle is None:
+            return self.reply(404, error('not_found', f"{method} {url.path} not found"))
+        if operation != 'iam.token' and fake.should_fail():
+            return self.reply(503, error('service_unavailable', 'injected failure'))
+        self.reply(*handle())
+
+    def route(self, method, parts, query, path):
+        """Return the operation name used for counting and a callable producing (status, body)."""
+        fake = self.server.fake
+        base_url = f"http://{self.headers['Host']}"
+        if parts[:2] == ['identity', 'token']:
+            return 'iam.token', lambda: (200, iam_token())
+        if parts[:3] == ['global', 'v2', 'vpc'] and method == 'GET':
+            return 'containers.get_clusters', fake.list_clusters
+        if parts[:3] == ['global', 'v1', 'clusters'] and method == 'DELETE':
+            return 'containers.delete_cluster', lambda: fake.delete_cluster(parts[3])
+        if parts[:2] == ['v2', 'resource_groups']:
+            return 'resource_manager.list_resource_groups', lambda: (200, {'resources': [
+                {'id': RESOURCE_GROUP, 'name': 'default', 'account_id': ACCOUNT_ID}]})
+        if parts[:2] == ['v2', 'resource_instances']:
+            if len(parts) == 2:
+                return 'resource_controller.list', lambda: fake.list_resource_instances(query)
+            if method == 'DELETE':
+                return 'resource_controller.delete', lambda: fake.delete_resource_instance(parts[2])
+            return 'resource_controller.get', lambda: fake.get_resource_instance(parts[2])
+        if parts[:2] == ['v1', 'regions']:
+            return 'vpc.list_regions', lambda: fake.list_regions(base_url)
+        if parts[0] == 'regions' and len(parts) > 3 and parts[1] in REGIONS and parts[2] == 'v1':
+            return self.route_vpc(method, parts[1], parts[3:], query, f"{base_url}{path}")
+        return f"unknown {method}", None
+
+    def route_vpc(self, method, region, parts, query, url):
+        fake = self.server.fake
+        collection = 'instance/templates' if parts[:2] == ['instance', 'templates'] else parts[0]
+        rest = parts[2:] if collection == 'instance/templates' else parts[1:]
+        if collection not in VPC_COLLECTIONS:
+            return f"vpc.unknown {method}", None
+        name = VPC_COLLECTIONS[collection][0]
+        if not rest and method == 'GET':
+            return f"vpc.list_{name}", lambda: fake.list_vpc(region, collection, query, url)
+        if len(rest) == 1 and method == 'DELETE':
+            return f"vpc.delete_{name}", lambda: fake.delete_vpc(region, collection, rest[0])
+        if collection == 'instance_groups':
+            if len(rest) == 1 and method == 'PATCH':
+                return 'vpc.update_instance_group', lambda: fake.update_instance_group(region, rest[0])
+            if rest[1:] == ['memberships']:
+                return 'vpc.list_instance_group_memberships', lambda: (200, {'memberships': [], 'total_count': 0})
+            if len(rest) == 3 and rest[1] == 'managers' and method == 'DELETE':
+                return 'vpc.delete_instance_group_manager', lambda: (204, None)
+        return f"vpc.unknown {method}", None
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        if body is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class FakeIBMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Regions and workers open many connections at once.
+    request_queue_size = 256
+
+    def __init__(self, address):
+        super().__init__(address, Handler)
+        self.fake = FakeIBM()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("Serve a fake IBM Cloud for the cleanup benchmarks.")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=0,
+                        help="Port to listen on; 0 picks a free one.")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default='empty',
+                        help="Resources to seed before the first reset.")
+    args = parser.parse_args()
+
+    server = FakeIBMServer((args.host, args.port))
+    server.fake.reset(args.scenario)
+    # The benchmark runner reads the address from this first line.
+    print(f"http://{args.host}:{server.server_address[1]}", flush=True)
+    server.serve_forever()
@@ -1,244 +1,318 @@
 import argparse
-import json
 import logging
 import os
-import sys
+import random
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache, partial
 
-import boto3
 import clean_ibm_sandbox
-import urllib3
+import http_client
+from checkpoint import get_checkpoint_store
+from log_context import account_context, configure_logging, submit_with_context
 from metrics import CleanUpSandboxMetrics
+from token_cache import TOKEN_CACHE
+from usage import get_usages
 
 
 def get_token(saa_api_key, saa_url):
     url = f"{saa_url}/token"
-    values = {
-        "api_key": saa_api_key
-    }
-    http = urllib3.PoolManager()
-    response = http.request('POST', url, fields=values)
-    token = json.loads(response.data.decode('utf-8'))
-    return token['access_token']
 
+    def request_token():
+        values = {
+            "api_key": saa_api_key
+        }
+        return http_client.request_json('POST', url, operation='saa_token', fields=values)
+
+    return TOKEN_CACHE.get_token(url, saa_api_key, request_token)
+
+
+def invalidate_token(saa_api_key, saa_url):
+    TOKEN_CACHE.invalidate(f"{saa_url}/token", saa_api_key)
 
-def get_accounts(saa_url, saa_token, query_type):
+
+def saa_request_json(saa_api_key, saa_url, method, url, **kwargs):
+    return http_client.request_json_with_token(method, url, partial(get_token, saa_api_key, saa_url),
+                                               partial(invalidate_token, saa_api_key, saa_url), **kwargs)
+
+
+def get_accounts(saa_url, saa_api_key, query_type):
     if query_type == 'cleanup':
         url = f"{saa_url}/sandbox/cleanup"
     elif query_type == 'verify':
         url = f"{saa_url}/sandbox/release"
 
-    headers = {
-        "Authorization": f"Bearer {saa_token}"
-    }
-
-    http = urllib3.PoolManager()
-    response = http.request(
+    response = saa_request_json(
+        saa_api_key,
+        saa_url,
         'GET',
         url,
-        headers=headers
+        operation='saa_get_accounts'
     )
 
-    response = json.loads(response.data.decode('utf-8'))
-
     return response
 
 
+# Shared by all accounts; None when neither CHECKPOINT_TABLE nor CHECKPOINT_DIR is set.
+# Created on first use rather than at import, as the DynamoDB client logs
+# and would otherwise configure logging before configure_logging() runs.
+@lru_cache(maxsize=None)
+def get_shared_checkpoint_store():
+    return get_checkpoint_store()
+
+
+# Set when a worker is asked to stop: accounts already being cleaned are
+# finished, queued ones are left for the next run.
+SHUTDOWN = threading.Event()
+
+
+def clean_account(saa_api_key, saa_url, account, max_parallel_regions=1):
+    cloud_provider = account['cloud_provider']['S']
+    account_name = account['account_name']['S']
+    account_context.set(account_name)
+
+    if SHUTDOWN.is_set():
+        logging.info(f"Shutting down; leaving account {account_name} for the next run.")
+        return
+
+    ibm_api_key = account['master_api_key']['S']
+    labels = {'account': account_name, 'cloud_provider': cloud_provider}
+    logging.info(f"Starting clean of account {account_name}")
+    try:
+        cleaning = clean_ibm_sandbox.clean(ibm_api_key, max_parallel_regions=max_parallel_regions,
+                                           checkpoint_store=get_shared_checkpoint_store(), account_name=account_name)
+    except Exception:
+        # A failed region or leftover RHOIC cluster raises; the account is
+        # reported as not clean and its cleanup timestamp is left alone.
+        CleanUpSandboxMetrics.push_clean_metrics('ibm_clean_accounts', 1, 'check_cleanup', labels)
+        raise
+    if not cleaning:
+        clean_status = 0
+        update_account(saa_url, saa_api_key, account_name, cloud_provider, 'cleanup')
+        logging.info(
+            f"No resources found in account {account_name}; marking cleanup timestamp.")
+    else:
+        logging.error(
+            f"Account {account['account_name']} in cloud provider {account['cloud_provider']} could not be fully cleaned.")
+        clean_status = 1
+
+    CleanUpSandboxMetrics.push_clean_metrics('ibm_clean_accounts', clean_status, 'check_cleanup', labels)
+
+
 @CleanUpSandboxMetrics.record_request_latency
-def clean_accounts(saa_api_key, saa_url, account_to_clean=None):
-    saa_token = get_token(saa_api_key, saa_url)
-    need_clean_accounts = get_accounts(saa_url, saa_token, 'cleanup')
+def clean_accounts(saa_api_key, saa_url, account_to_clean=None, max_parallel_regions=1, max_parallel_accounts=1):
+    need_clean_accounts = get_accounts(saa_url, saa_api_key, 'cleanup')
     if need_clean_accounts:
         logging.info(f"Accounts needing cleanup: {need_clean_accounts}")
-        for account in need_clean_accounts:
-            cloud_provider = account['cloud_provider']['S']
-            account_name = account['account_name']['S']
+        with ThreadPoolExecutor(max_workers=max(1, max_parallel_accounts)) as executor:
+            futures = {}
+            for account in need_clean_accounts:
+                account_name = account['account_name']['S']
+
+                if account_to_clean and account_name != account_to_clean:
+                    logging.info(f"Skipping account {account_name}")
+                    continue
+
+                future = submit_with_context(executor, clean_account, saa_api_key, saa_url,
+                                             account, max_parallel_regions)
+                futures[future] = account_name
+
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error(f"Error cleaning account {futures[future]}: {e}")
+    else:
+        logging.info("No accounts need cleanup.")
+        return
 
-            if account_to_clean and account_name != account_to_clean:
-                logging.info(f"Skipping account {account_name}")
-                continue
 
-            ibm_api_key = account['master_api_key']['S']
-            labels = {'account': account_name, 'cloud_provider': cloud_provider}
-            logging.info(f"Starting clean of account {account_name}")
-            cleaning = clean_ibm_sandbox.clean(ibm_api_key)
-            if not cleaning:
-                saa_token = get_token(saa_api_key, saa_url)
-                clean_status = 0
-                update_account(saa_url, saa_token, account_name, cloud_provider, 'cleanup')
-                logging.info(
-                    f"No resources found in account {account_name}; marking cleanup timestamp.")
-            else:
-                logging.error(
-                    f"Account {account['account_name']} in cloud provider {account['cloud_provider']} could not be fully cleaned.")
-                clean_status = 1
+def ready_for_verification(account, now):
+    cleanup_time = datetime.fromisoformat(account['cleanup_time']['S'])
+    return now >= cleanup_time + timedelta(hours=8)
+
 
-            CleanUpSandboxMetrics.push_clean_metrics('ibm_clean_accounts', clean_status, 'check_cleanup', labels)
+def compare_usage(account, usage):
+    """Log and export the two billing points; return True when the account can be released."""
+    account_name = account['account_name']['S']
+    labels = {'account': account_name, 'cloud_provider': account['cloud_provider']['S']}
+    no_current_usage = False
+
+    if usage.previous_cost is not None:
+        logging.info(
+            f"{account_name} previous usage is {usage.previous_cost}")
     else:
-        logging.info("No accounts need cleanup.")
-        return
+        logging.error(
+            f"There is no previous usage data for {account_name}"
+        )
+        no_current_usage = True
+
+    if usage.current_cost is not None:
+        logging.info(
+            f"{account_name} current usage is {usage.current_cost}")
+    else:
+        logging.error(
+            f"There is no current usage data for {account_name}"
+        )
+        no_current_usage = True
+
+    if no_current_usage:
+        current_cost = 0
+        previous_cost = 0
+    else:
+        current_cost = usage.current_cost
+        previous_cost = usage.previous_cost
+
+    CleanUpSandboxMetrics.push_clean_metrics('ibm_current_usage',
+                                             current_cost,
+                                             'verify_account',
+                                             dict(labels),
+                                             'verify_account'
+                                             )
+    CleanUpSandboxMetrics.push_clean_metrics('ibm_previous_usage',
+                                             previous_cost,
+                                             'verify_account',
+                                             dict(labels),
+                                             'verify_account'
+                                             )
+
+    if current_cost > previous_cost:
+        logging.warning(
+            f"The current charges of {current_cost} are greater than the previous charges of {previous_cost} in account {account_name}.")
+        return False
+    logging.info(
+        f"No additional charges detected in account {account_name}.")
+    return True
+
+
+def release_account(saa_url, saa_api_key, account):
+    account_name = account['account_name']['S']
+    account_context.set(account_name)
+    update_account(saa_url, saa_api_key, account_name,
+                   account['cloud_provider']['S'], 'verify'
+                   )
+    logging.info(f"Account {account_name} released.")
 
 
 @CleanUpSandboxMetrics.record_request_latency
-def verify_accounts(saa_api_key, saa_url, account_to_verify=None):
-    billing_table = os.environ.get('IBM_USAGE_DB')
-    aws_access_key_id = os.environ.get('AWS_ACCESS_KEY_ID')
-    aws_secret_access_key = os.environ.get('AWS_SECRET_ACCESS_KEY')
-    aws_region = os.environ.get('AWS_REGION')
-
-    if aws_access_key_id and aws_secret_access_key and aws_region:
-        aws_session = boto3.Session(
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            region_name=aws_region
-            )
-        db = aws_session.client('dynamodb')
-        logging.info("Using production dynamodb.")
-    else:
-        db = boto3.client('dynamodb', endpoint_url='http://localhost:8000')
-        logging.info("Using local development dynamodb")
+def verify_accounts(saa_api_key, saa_url, account_to_verify=None, max_parallel_releases=8):
+    need_verify_accounts = get_accounts(saa_url, saa_api_key, 'verify')
 
-    saa_token = get_token(saa_api_key, saa_url)
-    need_verify_accounts = get_accounts(saa_url, saa_token, 'verify')
+    if not need_verify_accounts:
+        logging.info("No accounts need usage verification.")
+        return
+
+    logging.info(f"Accounts needing verification: {need_verify_accounts}")
 
-    if need_verify_accounts:
-        logging.info(f"Accounts needing verification: {need_verify_accounts}")
+    # Readiness only depends on the cleanup time, so accounts that are not
+    # due yet are dropped before any lookup.
+    with CleanUpSandboxMetrics.time_verify_stage('filter'):
+        now = datetime.now(timezone.utc)
+        ready_accounts = []
         for account in need_verify_accounts:
             account_name = account['account_name']['S']
-
             if account_to_verify and account_name != account_to_verify:
                 continue
+            if ready_for_verification(account, now):
+                logging.info(f"Evaluating account {account_name}.")
+                ready_accounts.append(account)
+            else:
+                logging.info(f"Account {account_name} is not ready to be verified.")
 
-            cloud_provider = account['cloud_provider']['S']
-            logging.info(f"Starting verification of account {account_name}")
-            cleanup_time = datetime.fromisoformat(account['cleanup_time']['S'])
-            verification_time = cleanup_time + timedelta(hours=8)
-            labels = {'account': account_name, 'cloud_provider': cloud_provider}
-            if datetime.now(timezone.utc) >= verification_time:
-                logging.info(f"Evaluating account {account['account_name']['S']}.")
-                previous_usage_time = (datetime.now(timezone.utc) - timedelta(hours=1, minutes=20)).strftime('%Y-%m-%dT%H:%M')
-                logging.info(f"Previous usage timestamp is {previous_usage_time}")
-                previous_usage = db.query(
-                    TableName=billing_table,
-                    KeyConditionExpression='account_name = :an AND begins_with(#t, :ts)',
-                    ExpressionAttributeValues={
-                        ":an": {
-                            "S": account_name
-                        },
-                        ":ts": {
-                            "S": previous_usage_time
-                        }
-                    },
-                    ExpressionAttributeNames={
-                        "#t": "timestamp"
-                    }
-                )
-                no_current_usage = False
-
-                if previous_usage['Items']:
-                    logging.info(
-                        f"{account_name} previous usage is {previous_usage['Items'][0]['billable_cost']['N']}")
-                else:
-                    logging.error(
-                        f"There is no previous usage data for {account_name}"
-                    )
-                    no_current_usage = True
-
-                current_usage_time = (datetime.now(timezone.utc) - timedelta(minutes=20)).strftime('%Y-%m-%dT%H')
-                logging.info(f"Current usage timestamp is {current_usage_time}")
-                current_usage = db.query(
-                    TableName=billing_table,
-                    KeyConditionExpression='account_name = :an AND begins_with(#t, :ts)',
-                    ExpressionAttributeValues={
-                        ":an": {
-                            "S": account_name
-                        },
-                        ":ts": {
-                            "S": current_usage_time
-                        }
-                    },
-                    ExpressionAttributeNames={
-                        "#t": "timestamp"
-                    }
-                )
-
-                if current_usage['Items']:
-                    logging.info(
-                        f"{account_name} current usage is {current_usage['Items'][0]['billable_cost']['N']}")
-                else:
-                    logging.error(
-                        f"There is no current usage data for {account_name}"
-                    )
-                    no_current_usage = True
-
-                if no_current_usage:
-                    current_cost = 0
-                    previous_cost = 0
-                else:
-                    current_cost = float(
-                        current_usage['Items'][0]['billable_cost']['N'])
-                    previous_cost = float(
-                        previous_usage['Items'][0]['billable_cost']['N'])
-
-                CleanUpSandboxMetrics.push_clean_metrics('ibm_current_usage',
-                                                         current_cost,
-                                                         'verify_account',
-                                                         labels,
-                                                         'verify_account'
-                                                         )
-                CleanUpSandboxMetrics.push_clean_metrics('ibm_previous_usage',
-                                                         previous_cost,
-                                                         'verify_account',
-                                                         labels,
-                                                         'verify_account'
-                                                         )
-
-                if current_cost > previous_cost:
-                    logging.warning(
-                        f"The current charges of {current_cost} are greater than the previous charges of {previous_cost} in account {account_name}.")
-                else:
-                    logging.info(
-                        f"No additional charges detected in account {account_name}.")
-                    saa_token = get_token(saa_api_key, saa_url)
-                    update_account(saa_url, saa_token, account_name,
-                                   cloud_provider, 'verify'
-                                   )
-                    logging.info(f"Account {account_name} released.")
+    if not ready_accounts:
+        return
 
-            else:
-                logging.info(
-                    f"Account {account['account_name']['S']} is not ready to be verified.")
+    with CleanUpSandboxMetrics.time_verify_stage('usage'):
+        usages = get_usages([account['account_name']['S'] for account in ready_accounts])
 
-    else:
-        logging.info("No accounts need usage verification.")
+    with CleanUpSandboxMetrics.time_verify_stage('decide'):
+        releasable = [account for account in ready_accounts
+                      if account['account_name']['S'] in usages
+                      and compare_usage(account, usages[account['account_name']['S']])]
+
+    if not releasable:
+        return
+
+    with CleanUpSandboxMetrics.time_verify_stage('release'):
+        with ThreadPoolExecutor(max_workers=max(1, max_parallel_releases)) as executor:
+            futures = {submit_with_context(executor, release_account, saa_url, saa_api_key, account):
+                       account['account_name']['S'] for account in releasable}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logging.error(f"Error releasing account {futures[future]}: {e}")
 
 
-def update_account(saa_url, saa_token, account_name, cloud_provider, update_type):
+def update_account(saa_url, saa_api_key, account_name, cloud_provider, update_type):
     if update_type == 'cleanup':
         url = f"{saa_url}/sandbox/cleanup"
     elif update_type == 'verify':
         url = f"{saa_url}/sandbox/release"
 
-    headers = {
-        "Authorization": f"Bearer {saa_token}"
-    }
     values = {
         "account_name": account_name,
         "cloud_provider": cloud_provider
     }
 
-    http = urllib3.PoolManager()
-    response = http.request(
+    response = saa_request_json(
+        saa_api_key,
+        saa_url,
         'POST',
         url,
-        headers=headers,
+        operation='saa_update_account',
         fields=values
     )
-    response = json.loads(response.data.decode('utf-8'))
     return response
 
 
-def main(api_key=None, account=None):
+def run_once(saa_api_key, saa_url, account=None, max_parallel_regions=1, max_parallel_accounts=1):
+    try:
+        clean_accounts(saa_api_key, saa_url, account_to_clean=account,
+                       max_parallel_regions=max_parallel_regions,
+                       max_parallel_accounts=max_parallel_accounts)
+    except Exception as e:
+        logging.error(f"Error cleaning accounts: {e}")
+
+    if SHUTDOWN.is_set():
+        return
+
+    try:
+        verify_accounts(saa_api_key, saa_url, account_to_verify=account,
+                        max_parallel_releases=max_parallel_accounts)
+    except Exception as e:
+        logging.error(f"Error verifying accounts: {e}")
+
+
+def run_worker(saa_api_key, saa_url, account=None, max_parallel_regions=1, max_parallel_accounts=1,
+               poll_interval=60, poll_jitter=10):
+    """
+    Poll SAA for accounts to clean and release until SIGTERM or SIGINT.
+
+    The process stays up between polls, so the HTTP pool, token cache,
+    IAM authenticators and DynamoDB client are reused. A stop signal lets
+    the accounts in progress finish; metrics are pushed after every poll.
+    """
+    def stop(signum, frame):
+        logging.info(f"Received signal {signum}, stopping after the accounts in progress.")
+        SHUTDOWN.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logging.info(f"Worker polling every {poll_interval}s (+ up to {poll_jitter}s jitter).")
+    while not SHUTDOWN.is_set():
+        run_once(saa_api_key, saa_url, account, max_parallel_regions, max_parallel_accounts)
+        CleanUpSandboxMetrics.flush_metrics()
+        # Jitter keeps several workers from polling SAA in lockstep.
+        SHUTDOWN.wait(poll_interval + random.uniform(0, poll_jitter))
+    logging.info("Worker stopped.")
+
+
+def main(api_key=None, account=None, max_parallel_regions=1, max_parallel_accounts=1,
+         worker=False, poll_interval=60, poll_jitter=10):
     if api_key is None:
         saa_api_key = os.environ.get('SAA_API_KEY')
     elif api_key:
@@ -255,23 +329,20 @@ def main(api_key=None, account=None):
         logging.error("Push Gateway asssignment PUSH_GATEWAY_URL must be set as env variable")
 
     CleanUpSandboxMetrics.push_metrics()
+    CleanUpSandboxMetrics.start_publisher()
 
     try:
-        clean_accounts(saa_api_key, saa_url, account_to_clean=account)
-    except Exception as e:
-        logging.error(f"Error cleaning accounts: {e}")
-        pass
-
-    try:
-        verify_accounts(saa_api_key, saa_url, account_to_verify=account)
-    except Exception as e:
-        logging.error(f"Error verifying accounts: {e}")
-        pass
+        if worker:
+            run_worker(saa_api_key, saa_url, account, max_parallel_regions, max_parallel_accounts,
+                       poll_interval, poll_jitter)
+        else:
+            run_once(saa_api_key, saa_url, account, max_parallel_regions, max_parallel_accounts)
+    finally:
+        CleanUpSandboxMetrics.stop_publisher()
 
 
 if __name__ == "__main__":
-    logging.basicConfig(stream=sys.stdout, level=logging.INFO,
-                        format='%(asctime)s %(module)s %(levelname)s %(message)s', datefmt='%Y-%m-%dT%H:%M:%S%z')
+    configure_logging()
 
     parser = argparse.ArgumentParser(
         "Get billing data from cloud provider")
@@ -279,6 +350,23 @@ if __name__ == "__main__":
                         help="The API key to the account assignment API.")
     parser.add_argument("--account", required=False,
                         help="The account to verifty or clean up.")
+    parser.add_argument("--max-parallel-regions", type=int,
+                        default=int(os.environ.get('MAX_PARALLEL_REGIONS', 4)),
+                        help="How many regions of an account to clean at the same time.")
+    parser.add_argument("--max-parallel-accounts", type=int,
+                        default=int(os.environ.get('MAX_PARALLEL_ACCOUNTS', 4)),
+                        help="How many accounts to clean at the same time.")
+    parser.add_argument("--worker", action='store_true',
+                        default=os.environ.get('WORKER_MODE', 'false').lower() in ('1', 'true', 'yes'),
+                        help="Keep running and poll for accounts instead of exiting after one pass.")
+    parser.add_argument("--poll-interval", type=float,
+                        default=float(os.environ.get('POLL_INTERVAL_SECONDS', 60)),
+                        help="Seconds between polls in worker mode.")
+    parser.add_argument("--poll-jitter", type=float,
+                        default=float(os.environ.get('POLL_JITTER_SECONDS', 10)),
+                        help="Up to this many seconds are added at random to each poll interval.")
     args = parser.parse_args()
 
-    main(api_key=args.api_key, account=args.account)
+    main(api_key=args.api_key, account=args.account, max_parallel_regions=args.max_parallel_regions,
+         max_parallel_accounts=args.max_parallel_accounts,
+         worker=args.worker, poll_interval=args.poll_interval, poll_jitter=args.poll_jitter)
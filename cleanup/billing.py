@@ -0,0 +1,275 @@
+import json
+import logging
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from time import sleep
+
+from log_context import submit_with_context
+from metrics import UpdateBillingMetrics
+
+logger = logging.getLogger()
+
+# BatchWriteItem accepts at most 25 put requests per call.
+BATCH_SIZE = 25
+MAX_ATTEMPTS = 6
+# In delta mode an unchanged cost is still written once this much time
+# has passed, so readers never have to look back further than this.
+HEARTBEAT = timedelta(hours=float(os.environ.get('BILLING_HEARTBEAT_HOURS', 24)))
+# Last-cost queries in flight at once in delta mode, across all account groups.
+LOOKUP_WORKERS = int(os.environ.get('BILLING_LOOKUP_WORKERS', 16))
+
+
+def billing_item(account_name, account_id, billable_cost, billing_month, cloud_provider, billing_ttl, timestamp):
+    return {
+        "account_name": {
+            "S": account_name
+        },
+        "cloud_provider": {
+            "S": cloud_provider
+        },
+        "account_id": {
+            "S": account_id
+        },
+        "billing_month": {
+            "S": billing_month
+        },
+        "billable_cost": {
+            "N": str(billable_cost)
+        },
+        "timestamp": {
+            "S": timestamp
+        },
+        "ttl": {
+            "N": str(billing_ttl.timestamp())
+        }
+    }
+
+
+# Recorded under the label of the per-record put_item writes it replaced,
+# so the existing latency series and dashboards carry on.
+@UpdateBillingMetrics.record_request_latency(method_name='create_record')
+def write_batch(db, request_items):
+    return db.batch_write_item(RequestItems=request_items)
+
+
+def needs_write(last, billable_cost, timestamp):
+    """Whether a record must be written given the last (cost, timestamp) written for the account."""
+    if last is None:
+        return True
+    last_cost, last_timestamp = last
+    if float(last_cost) != float(billable_cost):
+        return True
+    return datetime.fromisoformat(timestamp) - datetime.fromisoformat(last_timestamp) >= HEARTBEAT
+
+
+class DynamoDBCostIndex:
+    """
+    Last written (cost, timestamp) per account, read with a one-item
+    newest-first query on the billing table.
+
+    prefetch() runs the queries of a batch of accounts concurrently on a
+    pool of LOOKUP_WORKERS threads shared by all callers; get() queries an
+    account that was not prefetched.
+    """
+
+    def __init__(self, db, billing_table, max_workers=LOOKUP_WORKERS):
+        self.db = db
+        self.billing_table = billing_table
+        self._costs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='cost-index')
+
+    def _query(self, account_name):
+        response = self.db.query(
+            TableName=self.billing_table,
+            KeyConditionExpression='account_name = :an',
+            ExpressionAttributeValues={
+                ":an": {
+                    "S": account_name
+                }
+            },
+            ExpressionAttributeNames={
+                "#t": "timestamp"
+            },
+            ProjectionExpression='billable_cost, #t',
+            ScanIndexForward=False,
+            Limit=1
+        )
+        items = response['Items']
+        return (items[0]['billable_cost']['N'], items[0]['timestamp']['S']) if items else None
+
+    def prefetch(self, account_names):
+        with self._lock:
+            missing = [name for name in dict.fromkeys(account_names) if name not in self._costs]
+        lookups = {name: submit_with_context(self._executor, self._query, name) for name in missing}
+        for name, lookup in lookups.items():
+            try:
+                last = lookup.result()
+            except Exception as e:
+                # get() queries the account again on its own.
+                logger.warning(f"Looking up the last cost of {name} failed with {e}")
+                continue
+            with self._lock:
+                self._costs.setdefault(name, last)
+
+    def get(self, account_name):
+        with self._lock:
+            if account_name in self._costs:
+                return self._costs[account_name]
+        last = self._query(account_name)
+        with self._lock:
+            self._costs[account_name] = last
+        return last
+
+    def update(self, account_name, billable_cost, timestamp):
+        with self._lock:
+            self._costs[account_name] = (str(billable_cost), timestamp)
+
+    def save(self):
+        self._executor.shutdown()
+
+
+class FileCostIndex:
+    """Last written (cost, timestamp) per account kept in a local JSON file between runs."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self._costs = {name: tuple(last) for name, last in json.load(f).items()}
+        except FileNotFoundError:
+            self._costs = {}
+
+    def prefetch(self, account_names):
+        pass
+
+    def get(self, account_name):
+        with self._lock:
+            return self._costs.get(account_name)
+
+    def update(self, account_name, billable_cost, timestamp):
+        with self._lock:
+            self._costs[account_name] = (str(billable_cost), timestamp)
+
+    def save(self):
+        with self._lock:
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self._costs, f)
+            os.replace(self.path + '.tmp', self.path)
+
+
+def get_cost_index(db, billing_table):
+    """Return the cost index for delta mode (BILLING_DELTA_MODE), or None to write every record."""
+    if os.environ.get('BILLING_DELTA_MODE', 'false').lower() not in ('1', 'true', 'yes'):
+        return None
+    cache_file = os.environ.get('BILLING_COST_CACHE')
+    if cache_file:
+        return FileCostIndex(cache_file)
+    return DynamoDBCostIndex(db, billing_table)
+
+
+class BillingWriter:
+    """
+    Collects billing records and writes them to DynamoDB with BatchWriteItem.
+
+    Records are keyed by account name, so an account reported twice in one
+    run is written once with its latest cost. A batch is sent as soon as
+    BATCH_SIZE records are pending and flush() writes the rest. Items
+    DynamoDB returns as unprocessed are retried with jittered exponential
+    backoff; per-account success and failure go to UpdateBillingMetrics.
+
+    With a cost index (delta mode) a record is only written when the cost
+    changed since the last written record or HEARTBEAT has passed.
+    """
+
+    def __init__(self, db, billing_table, billing_ttl, billing_month, cloud_provider, cost_index=None):
+        self.db = db
+        self.billing_table = billing_table
+        self.billing_ttl = billing_ttl
+        self.billing_month = billing_month
+        self.cloud_provider = cloud_provider
+        self.cost_index = cost_index
+        # One timestamp per run, as the records of a run describe the same billing point.
+        self.timestamp = datetime.now(timezone.utc).isoformat("T", "minutes")
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.succeeded = []
+        self.failed = []
+        self.unchanged = []
+
+    def add(self, account_name, account_id, billable_cost):
+        if self.cost_index and not needs_write(self.cost_index.get(account_name), billable_cost, self.timestamp):
+            logger.info(f"Billing for account {account_name} unchanged, skipping write.")
+            with self._lock:
+                self.unchanged.append(account_name)
+            return
+        item = billing_item(account_name, account_id, billable_cost, self.billing_month,
+                            self.cloud_provider, self.billing_ttl, self.timestamp)
+        with self._lock:
+            self._pending[account_name] = item
+            if len(self._pending) < BATCH_SIZE:
+                return
+            batch = self._take(BATCH_SIZE)
+        self._write(batch)
+
+    def add_many(self, entries):
+        """add() each (account_name, account_id, billable_cost), looking up their last costs together first."""
+        entries = list(entries)
+        if self.cost_index:
+            self.cost_index.prefetch([account_name for account_name, _, _ in entries])
+        for entry in entries:
+            self.add(*entry)
+
+    def flush(self):
+        while True:
+            with self._lock:
+                batch = self._take(BATCH_SIZE)
+            if not batch:
+                break
+            self._write(batch)
+        if self.cost_index:
+            self.cost_index.save()
+
+    def _take(self, count):
+        names = list(self._pending)[:count]
+        return [self._pending.pop(name) for name in names]
+
+    def _write(self, batch):
+        names = [item['account_name']['S'] for item in batch]
+        requests = [{"PutRequest": {"Item": item}} for item in batch]
+        attempt = 0
+        try:
+            while requests:
+                response = write_batch(self.db, {self.billing_table: requests})
+                requests = response.get('UnprocessedItems', {}).get(self.billing_table, [])
+                attempt += 1
+                if not requests or attempt >= MAX_ATTEMPTS:
+                    break
+                logger.warning(f"{len(requests)} billing records unprocessed, retrying (attempt {attempt}).")
+                sleep(random.uniform(0, min(0.1 * 2 ** attempt, 5)))
+        except Exception as e:
+            logger.error(f"Writing billing batch failed with {e}")
+            unprocessed = set(names)
+        else:
+            unprocessed = {request['PutRequest']['Item']['account_name']['S'] for request in requests}
+
+        for account_name in names:
+            if account_name in unprocessed:
+                logger.error(f"Account {account_name} could not be updated.")
+                print(f"Account {account_name} could not be updated.")
+                UpdateBillingMetrics.push_billing_account_failures(account_name)
+                UpdateBillingMetrics.push_billing_account_failure_total()
+                with self._lock:
+                    self.failed.append(account_name)
+            else:
+                if self.cost_index:
+                    item = next(item for item in batch if item['account_name']['S'] == account_name)
+                    self.cost_index.update(account_name, item['billable_cost']['N'], self.timestamp)
+                UpdateBillingMetrics.push_billing_account_success(account_name)
+                print(f"Account {account_name} updated successfully.")
+                with self._lock:
+                    self.succeeded.append(account_name)
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import threading
+from time import time
+
+import dynamodb
+
+# Checkpoints older than this are ignored so a sandbox returned again
+# later is always cleaned from scratch.
+MAX_AGE = float(os.environ.get('CHECKPOINT_MAX_AGE_HOURS', 12)) * 3600
+
+PHASES = ['rhoic', 'regions', 'resources']
+
+
+class Checkpoint:
+    """Progress of the cleanup of one account: phase, finished regions and deleted resources."""
+
+    def __init__(self, account, phase='rhoic', regions_done=(), empty_types=None, deleted=None, updated=None):
+        self.account = account
+        self.phase = phase
+        self.regions_done = set(regions_done)
+        self.empty_types = {region: set(types) for region, types in (empty_types or {}).items()}
+        self.deleted = deleted or {}
+        self.updated = updated or time()
+        self._lock = threading.Lock()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'account': self.account,
+                'phase': self.phase,
+                'regions_done': sorted(self.regions_done),
+                'empty_types': {region: sorted(types) for region, types in self.empty_types.items()},
+                'deleted': self.deleted,
+                'updated': self.updated,
+            }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['account'], data['phase'], data['regions_done'],
+                   data['empty_types'], data['deleted'], data['updated'])
+
+    def is_stale(self):
+        return time() - self.updated > MAX_AGE
+
+    def phase_done(self, phase):
+        return PHASES.index(self.phase) > PHASES.index(phase)
+
+    def set_phase(self, phase):
+        with self._lock:
+            self.phase = phase
+            self.updated = time()
+
+    def region_done(self, region):
+        return region in self.regions_done
+
+    def types_empty(self, region):
+        with self._lock:
+            return set(self.empty_types.get(region, ()))
+
+    def record_region(self, region, empty_types, deleted, done):
+        with self._lock:
+            self.empty_types.setdefault(region, set()).update(empty_types)
+            for resource_type, ids in deleted.items():
+                if ids:
+                    region_deleted = self.deleted.setdefault(region, {})
+                    region_deleted[resource_type] = sorted(set(region_deleted.get(resource_type, [])) | set(ids))
+            if done:
+                self.regions_done.add(region)
+            self.updated = time()
+
+
+class LocalCheckpointStore:
+    """Keeps one JSON file per account in a local directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, account):
+        return os.path.join(self.directory, f"{account}.json")
+
+    def load(self, account):
+        try:
+            with open(self._path(account)) as f:
+                return Checkpoint.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+
+    def save(self, checkpoint):
+        path = self._path(checkpoint.account)
+        with self._lock:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(checkpoint.to_dict(), f)
+            os.replace(path + '.tmp', path)
+
+    def delete(self, account):
+        try:
+            os.remove(self._path(account))
+        except FileNotFoundError:
+            pass
+
+
+class DynamoDBCheckpointStore:
+    """Keeps checkpoints in a DynamoDB table keyed by account_name, expiring them with a ttl attribute."""
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self._lock = threading.Lock()
+
+    def load(self, account):
+        response = self.db.get_item(
+            TableName=self.table,
+            Key={"account_name": {"S": account}},
+            ConsistentRead=True
+        )
+        if 'Item' not in response:
+            return None
+        return Checkpoint.from_dict(json.loads(response['Item']['checkpoint']['S']))
+
+    def save(self, checkpoint):
+        with self._lock:
+            data = checkpoint.to_dict()
+            self.db.put_item(
+                TableName=self.table,
+                Item={
+                    "account_name": {"S": checkpoint.account},
+                    "checkpoint": {"S": json.dumps(data)},
+                    "ttl": {"N": str(int(data['updated'] + MAX_AGE))}
+                }
+            )
+
+    def delete(self, account):
+        self.db.delete_item(TableName=self.table, Key={"account_name": {"S": account}})
+
+
+def get_checkpoint_store():
+    """Return the store configured by CHECKPOINT_TABLE or CHECKPOINT_DIR, or None to disable checkpoints."""
+    table = os.environ.get('CHECKPOINT_TABLE')
+    if table:
+        return DynamoDBCheckpointStore(dynamodb.get_client(), table)
+    directory = os.environ.get('CHECKPOINT_DIR')
+    if directory:
+        return LocalCheckpointStore(directory)
+    return None
+
+
+def save_checkpoint(store, checkpoint):
+    """Persist the checkpoint; a failing store only costs the ability to resume."""
+    if store is None:
+        return
+    try:
+        store.save(checkpoint)
+    except Exception as e:
+        logging.warning(f"Saving checkpoint failed with {e}")
+
+
+def clear_checkpoint(store, account):
+    """Drop the checkpoint of an account that was cleaned completely."""
+    if store is None or account is None:
+        return
+    try:
+        store.delete(account)
+    except Exception as e:
+        logging.warning(f"Deleting checkpoint failed with {e}")
+
+
+def load_checkpoint(store, account):
+    if store is None or account is None:
+        return Checkpoint(account)
+    try:
+        checkpoint = store.load(account)
+    except Exception as e:
+        logging.warning(f"Loading checkpoint failed with {e}")
+        checkpoint = None
+    if checkpoint and not checkpoint.is_stale():
+        logging.info(
+            f"Resuming cleanup from phase {checkpoint.phase} with regions done: {sorted(checkpoint.regions_done)}")
+        return checkpoint
+    return Checkpoint(account)
@@ -1,28 +1,131 @@
 import argparse
-import json
 import logging
-import sys
-from time import sleep
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache, partial
 from urllib.parse import urlencode
 
-import urllib3
+import http_client
+import report
 from ibm_cloud_sdk_core import ApiException
 from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
 from ibm_platform_services.resource_controller_v2 import ResourceControllerV2
 from ibm_platform_services.resource_manager_v2 import ResourceManagerV2
 from ibm_vpc import VpcV1
+from checkpoint import clear_checkpoint, load_checkpoint, save_checkpoint
+from instrumentation import instrument
+from inventory import RegionInventory, ResourceInstanceInventory
+from log_context import configure_logging, submit_with_context
+from metrics import CleanUpSandboxMetrics
+from pagination import paginate
+from scheduler import run_graph
+from token_cache import TOKEN_CACHE
+from waiter import is_deleting, wait_for_resources
+
+
+IAM_URL = os.environ.get('IBM_IAM_URL', 'https://iam.cloud.ibm.com')
+CONTAINERS_URL = os.environ.get('IBM_CONTAINERS_URL', 'https://containers.cloud.ibm.com')
+# Optional endpoint overrides, e.g. to run the cleaner against a local
+# stand-in of the IBM Cloud APIs.
+VPC_URL = os.environ.get('IBM_VPC_URL')
+RESOURCE_CONTROLLER_URL = os.environ.get('IBM_RESOURCE_CONTROLLER_URL')
+RESOURCE_MANAGER_URL = os.environ.get('IBM_RESOURCE_MANAGER_URL')
+
+# This region is causing a error 502
+SKIP_REGIONS = {'ca-tor'}
+
+# The security advisor resources cannot be deleted, so we
+# will exclude them from the list
+IGNORED_RESOURCES = ['security-advisor', 'schematics']
+# Resource controller instances deleted in one batch per type after the
+# region sweep, matched on a CRN fragment. Each type needs a WAIT_DEADLINES entry.
+RESOURCE_INSTANCE_TYPES = {
+    'cos_instances': 'cloud-object-storage',
+}
+
+# Upper bound, in seconds, on how long to wait for a batch of deletes of
+# each resource type to be accepted before checking for stuck resources.
+WAIT_DEADLINES = {
+    'instance_group_memberships': 90,
+    'instance_templates': 15,
+    'instances': 30,
+    'volumes': 30,
+    'keys': 30,
+    'images': 30,
+    'vpn_gateways': 90,
+    'load_balancers': 120,
+    'endpoint_gateways': 30,
+    'subnets': 30,
+    'public_gateways': 30,
+    'floating_ips': 30,
+    'vpcs': 30,
+    'security_groups': 15,
+    'rhoic_clusters': 600,
+    'cos_instances': 20,
+    'resource_controller': 60,
+}
+RETRY_DEADLINE = 15
+
+
+def wait_for_deletion(list_resources, resource_type, status_key='status'):
+    return wait_for_resources(list_resources, WAIT_DEADLINES[resource_type], status_key)
+
+
+def wait_for_retry(list_resources, status_key='status', deadline=RETRY_DEADLINE):
+    # Between retries only an empty listing ends the wait early, so
+    # resources that are still deleting get the full retry window.
+    return wait_for_resources(list_resources, deadline, status_key, settle_on_deleting=False)
 
 
 def get_token(api_key):
-    url = "https://iam.cloud.ibm.com/identity/token?"
-    values = {'grant_type': 'urn:ibm:params:oauth:grant-type:apikey',
-              'apikey': api_key}
-    encoded_args = urlencode(values)
-    url = url + encoded_args
-    http = urllib3.PoolManager()
-    response = http.request('POST', url)
-    token = json.loads(response.data.decode('utf-8'))
-    return token['access_token']
+    token_url = f"{IAM_URL}/identity/token"
+
+    def request_token():
+        values = {'grant_type': 'urn:ibm:params:oauth:grant-type:apikey',
+                  'apikey': api_key}
+        encoded_args = urlencode(values)
+        url = token_url + '?' + encoded_args
+        return http_client.request_json('POST', url, operation='iam_token')
+
+    return TOKEN_CACHE.get_token(token_url, api_key, request_token)
+
+
+def invalidate_token(api_key):
+    TOKEN_CACHE.invalidate(f"{IAM_URL}/identity/token", api_key)
+
+
+# One authenticator per API key, so a long-running worker keeps reusing
+# the IAM token it holds (it refreshes itself before expiry).
+@lru_cache(maxsize=256)
+def get_authenticator(api_key):
+    return IAMAuthenticator(api_key, url=IAM_URL)
+
+
+def new_resource_manager(authenticator):
+    resource_manager = ResourceManagerV2(authenticator=authenticator)
+    if RESOURCE_MANAGER_URL:
+        resource_manager.set_service_url(RESOURCE_MANAGER_URL)
+    return instrument(resource_manager)
+
+
+def new_resource_controller(authenticator):
+    resource_controller = ResourceControllerV2(authenticator=authenticator)
+    if RESOURCE_CONTROLLER_URL:
+        resource_controller.set_service_url(RESOURCE_CONTROLLER_URL)
+    return instrument(resource_controller)
+
+
+def new_vpc_service(authenticator, base_url=None, region='global'):
+    service = VpcV1(authenticator=authenticator, generation=2)
+    if base_url or VPC_URL:
+        service.set_service_url(base_url or VPC_URL)
+    return instrument(service, region)
+
+
+def get_regions(service):
+    return [region for region in service.list_regions().get_result()['regions']
+            if region['name'] not in SKIP_REGIONS]
 
 
 def get_resource_groups(resource_manager):
@@ -34,547 +137,469 @@ def get_resource_groups(resource_manager):
 
 
 def get_instance_groups(service):
-    instance_groups = service.list_instance_groups(limit=100).get_result()[
-        'instance_groups']
-    response = []
-    for ig in instance_groups:
-        response.append(ig)
-    return response
+    return paginate(service.list_instance_groups, 'instance_groups')
+
+
+def get_instance_group_memberships(service, instance_group_id):
+    return paginate(service.list_instance_group_memberships, 'memberships',
+                    instance_group_id=instance_group_id)
 
 
-def delete_instance_groups(service):
-    instance_groups = get_instance_groups(service)
+def delete_instance_groups(service, inventory):
+    instance_groups = inventory.get('instance_groups')
     instance_group_patch = {
         "membership_count": 0
     }
     for ig in instance_groups:
         try:
             # Remove the autoscale manager if it exists
-            for manager in ig['managers']:
+            for manager_id in ig.refs:
                 try:
                     service.delete_instance_group_manager(
-                        ig['id'], manager['id'])
+                        ig.id, manager_id)
                 except ApiException as e:
                     logging.error(f"{e.code}: {e.message}")
 
             # Set the membership_cout to 0, as defined
             # in instance_group_patch variable
             service.update_instance_group(
-                ig['id'], instance_group_patch)
+                ig.id, instance_group_patch)
 
             # Wait for the instance group to scale down to 0
-            ig_membership = service.list_instance_group_memberships(
-                ig['id']).get_result()['memberships']
-            if ig_membership:
-                attempt = 0
-                while attempt <= 5 and ig_membership:
-                    logging.info(
-                        f"Checking on instance group membership ({attempt})")
-                    sleep(15)
-                    attempt += 1
-                    ig_membership = service.list_instance_group_memberships(
-                        ig['id']).get_result()['memberships']
+            wait_for_deletion(
+                partial(get_instance_group_memberships, service, ig.id),
+                'instance_group_memberships', status_key=None)
 
             # Delete the instance group
             logging.info(
-                f"Deleting instance group {ig['id']} in VPC {ig['vpc']['id']} in resource group {ig['resource_group']['id']}")
-            service.delete_instance_group(ig['id'])
+                f"Deleting instance group {ig.id} in VPC {ig.vpc_id} in resource group {ig.resource_group}")
+            service.delete_instance_group(ig.id)
         except ApiException as e:
             logging.error(
                 f"Delete instance group failed with code {str(e.code)}: {str(e.message)}")
 
-    remaining_instance_groups = get_instance_groups(service)
+    remaining_instance_groups = inventory.refresh('instance_groups')
     if remaining_instance_groups:
         for ig in remaining_instance_groups:
             logging.error(
-                f"Instance group {ig['id']} could not be deleted. Investigate.")
+                f"Instance group {ig.id} could not be deleted. Investigate.")
     else:
         logging.info("All instance groups deleted successfully.")
 
 
 def get_instance_templates(service):
-    instance_templates = service.list_instance_templates().get_result()[
-        'templates']
-    response = []
-    for it in instance_templates:
-        response.append(it)
-    return response
+    # Instance templates are not paginated by the API
+    return paginate(service.list_instance_templates, 'templates', limit=None)
 
 
-def delete_instance_templates(service):
-    instance_templates = get_instance_templates(service)
+def delete_instance_templates(service, inventory):
+    instance_templates = inventory.get('instance_templates')
     for it in instance_templates:
         try:
             logging.info(
-                f"Deleting instance template {it['id']} in VPC: {it['vpc']['id']} in resource group {it['resource_group']['id']}")
-            service.delete_instance_template(it['id'])
+                f"Deleting instance template {it.id} in VPC: {it.vpc_id} in resource group {it.resource_group}")
+            service.delete_instance_template(it.id)
         except ApiException as e:
             logging.error(
                 f"Delete instance template failed with code {str(e.code)}: {str(e.message)}")
 
-    if instance_templates:
-        sleep(15)
-
-    remaining_instance_templates = get_instance_templates(service)
+    remaining_instance_templates = wait_for_deletion(
+        partial(inventory.refresh, 'instance_templates'), 'instance_templates')
     attempt = 0
     while attempt <= 5 and remaining_instance_templates:
         for it in remaining_instance_templates:
             try:
                 logging.warning(
-                    f"Instance template {it['id']} stuck in state {it['status']}.")
+                    f"Instance template {it.id} stuck in state {it.status}.")
                 logging.warning(
-                    f"Retrying delete of instance template {it['id']} for attemp {attempt}.")
-                service.delete_instance_template(it['id'])
+                    f"Retrying delete of instance template {it.id} for attemp {attempt}.")
+                service.delete_instance_template(it.id)
             except ApiException as e:
                 logging.error(
                     f"Delete instance template failed with code {e.code}: {e.message}")
         attempt += 1
-        sleep(15)
-        remaining_instance_templates = get_instance_templates(service)
+        remaining_instance_templates = wait_for_retry(partial(inventory.refresh, 'instance_templates'))
 
     if remaining_instance_templates:
         for it in remaining_instance_templates:
             logging.error(
-                f"Instance template {it['id']} could not be deleted. Investigate.")
+                f"Instance template {it.id} could not be deleted. Investigate.")
     else:
         logging.info("All instance templates deleted successfully.")
 
 
 def get_instances(service):
-    instances = service.list_instances(limit=100).get_result()['instances']
-    response = []
-    for instance in instances:
-        response.append(instance)
-    return response
+    return paginate(service.list_instances, 'instances')
 
 
-def delete_instances(service):
-    instances = get_instances(service)
+def delete_instances(service, inventory):
+    instances = inventory.get('instances')
     for instance in instances:
         try:
             logging.info(
-                f"Deleting instance {instance['id']} in VPC: {instance['vpc']['id']} in resource group: {instance['resource_group']['id']}")
-            service.delete_instance(instance['id'])
+                f"Deleting instance {instance.id} in VPC: {instance.vpc_id} in resource group: {instance.resource_group}")
+            service.delete_instance(instance.id)
         except ApiException as e:
             logging.error(
                 f"Delete instance failed with code {e.code}: {e.message}")
 
-    if instances:
-        sleep(30)
-
-    remaining_instances = get_instances(service)
+    remaining_instances = wait_for_deletion(partial(inventory.refresh, 'instances'), 'instances')
     attempt = 0
     while attempt <= 5 and remaining_instances:
         for instance in remaining_instances:
+            if is_deleting(instance):
+                continue
             try:
                 logging.warning(
-                    f"Instance {instance['id']} stuck in state {instance['status']}.")
+                    f"Instance {instance.id} stuck in state {instance.status}.")
                 logging.warning(
-                    f"Retrying delete of instance {instance['id']} for attempt {attempt}.")
-                service.delete_instance(instance['id'])
+                    f"Retrying delete of instance {instance.id} for attempt {attempt}.")
+                service.delete_instance(instance.id)
             except ApiException as e:
                 logging.error(
                     f"Delete instance failed with code {e.code}: {e.message}")
         attempt += 1
-        sleep(15)
-        remaining_instances = get_instances(service)
+        remaining_instances = wait_for_retry(partial(inventory.refresh, 'instances'))
 
     if remaining_instances:
         for instance in remaining_instances:
             logging.error(
-                f"Instance {instance['id']} could not be deleted. Investigate.")
+                f"Instance {instance.id} could not be deleted. Investigate.")
     else:
         logging.info("All instances deleted successfully.")
 
 
 def get_volumes(service):
-    volumes = service.list_volumes(limit=100).get_result()['volumes']
-    response = []
-    for volume in volumes:
-        response.append(volume)
-    return response
+    return paginate(service.list_volumes, 'volumes')
 
 
-def delete_volumes(service):
-    volumes = get_volumes(service)
+def delete_volumes(service, inventory):
+    volumes = inventory.get('volumes')
     for volume in volumes:
-        if volume['status'] in {'available', 'failed'}:
+        if volume.status in {'available', 'failed'}:
             try:
                 logging.info(
-                    f"Deleting volume {volume['id']} in: resource group: {volume['resource_group']['id']}")
-                service.delete_volume(volume['id'])
+                    f"Deleting volume {volume.id} in: resource group: {volume.resource_group}")
+                service.delete_volume(volume.id)
             except ApiException as e:
                 logging.error(
                     f"Delete volume failed with code {e.code}: {e.message}")
 
-    if volumes:
-        sleep(30)
-
-    remaining_volumes = get_volumes(service)
+    remaining_volumes = wait_for_deletion(partial(inventory.refresh, 'volumes'), 'volumes')
     attempt = 0
     while attempt <= 5 and remaining_volumes:
         for volume in remaining_volumes:
+            if is_deleting(volume):
+                continue
             logging.warning(
-                f"Volume {volume['id']} stuck in state {volume['status']}.")
-            if volume['status'] in {'available', 'failed'}:
+                f"Volume {volume.id} stuck in state {volume.status}.")
+            if volume.status in {'available', 'failed'}:
                 try:
                     logging.warning(
-                        f"Retrying delete of volume {volume['id']} for attempt {attempt}.")
-                    service.delete_volume(volume['id'])
+                        f"Retrying delete of volume {volume.id} for attempt {attempt}.")
+                    service.delete_volume(volume.id)
                 except ApiException as e:
                     logging.error(
                         f"Delete volume failed with code {e.code}: {e.message}")
         attempt += 1
-        sleep(15)
-        remaining_volumes = get_volumes(service)
+        remaining_volumes = wait_for_retry(partial(inventory.refresh, 'volumes'))
 
     if remaining_volumes:
         for volume in remaining_volumes:
             logging.error(
-                f"Volume {volume['id']} could not be deleted. Investigate.")
+                f"Volume {volume.id} could not be deleted. Investigate.")
     else:
         logging.info("All volumes deleted successfully.")
 
 
 def get_keys(service):
-    keys = service.list_keys(limit=100).get_result()['keys']
-    response = []
-    for key in keys:
-        response.append(key)
-    return response
+    return paginate(service.list_keys, 'keys')
 
 
-def delete_keys(service):
-    keys = get_keys(service)
+def delete_keys(service, inventory):
+    keys = inventory.get('keys')
     for key in keys:
         try:
             logging.info(
-                f"Deleting key {key['id']} in: resource group: {key['resource_group']['id']}")
-            service.delete_key(key['id'])
+                f"Deleting key {key.id} in: resource group: {key.resource_group}")
+            service.delete_key(key.id)
         except ApiException as e:
             logging.error(f"Delete key failed with code {e.code}: {e.message}")
 
-    if keys:
-        sleep(30)
-
-    remaining_keys = get_keys(service)
+    remaining_keys = wait_for_deletion(partial(inventory.refresh, 'keys'), 'keys')
     attempt = 0
     while attempt <= 5 and remaining_keys:
         for key in remaining_keys:
             try:
                 logging.warning(
-                    f"Retrying delete of key {key['id']} for attempt {attempt}.")
-                service.delete_key(key['id'])
+                    f"Retrying delete of key {key.id} for attempt {attempt}.")
+                service.delete_key(key.id)
             except ApiException as e:
                 logging.error(
                     f"Delete key failed with code {e.code}: {e.message}")
         attempt += 1
-        sleep(15)
-        remaining_keys = get_keys(service)
+        remaining_keys = wait_for_retry(partial(inventory.refresh, 'keys'))
 
     if remaining_keys:
         for key in remaining_keys:
             logging.error(
-                f"Key {key['id']} could not be deleted. Investigate.")
+                f"Key {key.id} could not be deleted. Investigate.")
     else:
         logging.info("All keys deleted successfully.")
 
 
-def get_images(service, resource_group):
-    images = service.list_images(
-        limit=100, resource_group_id=resource_group).get_result()['images']
-    if images:
-        image_list = []
-        for image in images:
-            image_list.append(image['id'])
-        return image_list
+def get_images(service):
+    # Only images owned by the account; public catalog images are not ours to delete
+    return paginate(service.list_images, 'images', visibility='private')
 
 
-def delete_images(service, resource_groups):
-    for resource_group in resource_groups:
-        images = get_images(service, resource_group)
-        if images:
-            for image in images:
-                try:
-                    logging.info(
-                        f"Deleting the following image in resource group {resource_group}: {image}"
-                    )
-                    service.delete_image(image)
-                except ApiException as e:
-                    logging.error(
-                        f"Delete image failed with code {e.code}: {e.message}"
-                    )
-
-        if images:
-            sleep(30)
+def delete_images(service, inventory, resource_groups):
+    def get_account_images(images):
+        return [image for image in images if image.resource_group in resource_groups]
 
-        remaining_images = get_images(service, resource_group)
-        attempt = 0
-        while attempt <= 5 and remaining_images:
-            for image in remaining_images:
-                try:
-                    logging.warning(
-                        f"Retrying delete of image {image['id']} for attempt {attempt}.")
-                    service.delete_image(image)
-                except ApiException as e:
-                    logging.error(
-                        f"Delete key failed with code {e.code}: {e.message}")
-            attempt += 1
-            sleep(15)
-            remaining_images = get_images(service, resource_group)
+    for image in get_account_images(inventory.get('images')):
+        try:
+            logging.info(
+                f"Deleting the following image in resource group {image.resource_group}: {image.id}"
+            )
+            service.delete_image(image.id)
+        except ApiException as e:
+            logging.error(
+                f"Delete image failed with code {e.code}: {e.message}"
+            )
 
-        if remaining_images:
-            for image in remaining_images:
+    remaining_images = wait_for_deletion(
+        lambda: get_account_images(inventory.refresh('images')), 'images')
+    attempt = 0
+    while attempt <= 5 and remaining_images:
+        for image in remaining_images:
+            if is_deleting(image):
+                continue
+            try:
+                logging.warning(
+                    f"Retrying delete of image {image.id} for attempt {attempt}.")
+                service.delete_image(image.id)
+            except ApiException as e:
                 logging.error(
-                    f"Key {image['id']} could not be deleted. Investigate.")
-        else:
-            logging.info("All images deleted successfully.")
+                    f"Delete image failed with code {e.code}: {e.message}")
+        attempt += 1
+        remaining_images = wait_for_retry(lambda: get_account_images(inventory.refresh('images')))
+
+    if remaining_images:
+        for image in remaining_images:
+            logging.error(
+                f"Image {image.id} could not be deleted. Investigate.")
+    else:
+        logging.info("All images deleted successfully.")
 
 
 def get_public_gateways(service):
-    public_gateways = service.list_public_gateways(
-        limit=100).get_result()['public_gateways']
-    response = []
-    for public_gateway in public_gateways:
-        response.append(public_gateway)
-    return response
+    return paginate(service.list_public_gateways, 'public_gateways')
 
 
-def delete_public_gateways(service):
-    public_gateways = get_public_gateways(service)
+def delete_public_gateways(service, inventory):
+    public_gateways = inventory.get('public_gateways')
     for public_gateway in public_gateways:
         try:
             logging.info(
-                f"Deleting public gateway {public_gateway['id']} in VPC: {public_gateway['vpc']['id']} resource group: {public_gateway['resource_group']['id']}")
-            service.delete_public_gateway(public_gateway['id'])
+                f"Deleting public gateway {public_gateway.id} in VPC: {public_gateway.vpc_id} resource group: {public_gateway.resource_group}")
+            service.delete_public_gateway(public_gateway.id)
         except ApiException as e:
             logging.error(
                 f"Delete public gateway failed with code {e.code}: {e.message}")
 
-    if public_gateways:
-        sleep(30)
-
-    remaining_public_gateways = get_public_gateways(service)
+    remaining_public_gateways = wait_for_deletion(partial(inventory.refresh, 'public_gateways'), 'public_gateways')
     attempt = 0
     while attempt <= 5 and remaining_public_gateways:
         for public_gateway in remaining_public_gateways:
+            if is_deleting(public_gateway):
+                continue
             try:
                 logging.warning(
-                    f"Public gateway {public_gateway['id']} stuck in state {public_gateway['status']}.")
+                    f"Public gateway {public_gateway.id} stuck in state {public_gateway.status}.")
                 logging.warning(
-                    f"Retrying delete of public gateway {public_gateway['id']} for attempt {attempt}.")
-                service.delete_public_gateway(public_gateway['id'])
+                    f"Retrying delete of public gateway {public_gateway.id} for attempt {attempt}.")
+                service.delete_public_gateway(public_gateway.id)
             except ApiException as e:
                 logging.error(
                     f"Delete public gateway failed with code {e.code}: {e.message}")
         attempt += 1
-        sleep(15)
-        remaining_public_gateways = get_public_gateways(service)
+        remaining_public_gateways = wait_for_retry(partial(inventory.refresh, 'public_gateways'))
 
     if remaining_public_gateways:
         for public_gateway in remaining_public_gateways:
             logging.error(
-                f"Public gateway {public_gateway['id']} could not be deleted. Investigate.")
+                f"Public gateway {public_gateway.id} could not be deleted. Investigate.")
     else:
         logging.info("All public gateways deleted successfully.")
 
 
 def get_floating_ips(service):
-    floating_ips = service.list_floating_ips(
-        limit=100).get_result()['floating_ips']
-    response = []
-    for fip in floating_ips:
-        response.append(fip)
-    return response
+    return paginate(service.list_floating_ips, 'floating_ips')
 
 
-def delete_floating_ips(service):
-    floating_ips = get_floating_ips(service)
+def delete_floating_ips(service, inventory):
+    floating_ips = inventory.get('floating_ips')
     for fip in floating_ips:
         try:
             logging.info(
-                f"Deleting floating ip {fip['address']} with ID {fip['id']} in resource group: {fip['resource_group']['id']}")
-            service.delete_floating_ip(fip['id'])
+                f"Deleting floating IP {fip.id} in resource group: {fip.resource_group}")
+            service.delete_floating_ip(fip.id)
         except ApiException as e:
             logging.error(
                 f"Delete floating IP failed with code {e.code}: {e.message}")
 
-    if floating_ips:
-        sleep(30)
-
-    remaining_floating_ips = get_floating_ips(service)
+    remaining_floating_ips = wait_for_deletion(partial(inventory.refresh, 'floating_ips'), 'floating_ips')
     attempt = 0
     while attempt <= 5 and remaining_floating_ips:
         for fip in remaining_floating_ips:
+            if is_deleting(fip):
+                continue
             try:
                 logging.warning(
-                    f"Floating IP {fip['id']} stuck in state {fip['status']}.")
+                    f"Floating IP {fip.id} stuck in state {fip.status}.")
                 logging.warning(
-                    f"Retrying delete of floating IP {fip['id']} for attempt {attempt}.")
-                service.delete_floating_ip(fip['id'])
+                    f"Retrying delete of floating IP {fip.id} for attempt {attempt}.")
+                service.delete_floating_ip(fip.id)
             except ApiException as e:
                 logging.error(
                     f"Delete instance failed with code {e.code}: {e.message}")
         attempt += 1
-        sleep(15)
-        remaining_floating_ips = get_floating_ips(service)
+        remaining_floating_ips = wait_for_retry(partial(inventory.refresh, 'floating_ips'))
 
     if remaining_floating_ips:
         for fip in remaining_floating_ips:
             logging.error(
-                f"Floating IP {fip['id']} could not be deleted. Investigate.")
+                f"Floating IP {fip.id} could not be deleted. Investigate.")
     else:
         logging.info("All floating IP deleted successfully.")
 
 
 def get_vpn_gateways(service):
-    vpn_gateways = service.list_vpn_gateways(
-        limit=100).get_result()['vpn_gateways']
-    response = []
-    for vpn_gateway in vpn_gateways:
-        response.append(vpn_gateway)
-    return response
+    return paginate(service.list_vpn_gateways, 'vpn_gateways')
 
 
-def delete_vpn_gateways(service):
-    vpn_gateways = get_vpn_gateways(service)
+def delete_vpn_gateways(service, inventory):
+    vpn_gateways = inventory.get('vpn_gateways')
     for vpn_gateway in vpn_gateways:
         try:
             logging.info(
-                f"Deleting VPN Gateway {vpn_gateway['id']} in resource group: {vpn_gateway['resource_group']['id']}")
-            service.delete_vpn_gateway(vpn_gateway['id'])
+                f"Deleting VPN Gateway {vpn_gateway.id} in resource group: {vpn_gateway.resource_group}")
+            service.delete_vpn_gateway(vpn_gateway.id)
         except ApiException as e:
             logging.error(
                 f"Delete VPN Gateway failed with code {e.code}: {e.message}")
 
-    if vpn_gateways:
-        sleep(90)
-
-    remaining_vpn_gateways = get_vpn_gateways(service)
+    remaining_vpn_gateways = wait_for_deletion(partial(inventory.refresh, 'vpn_gateways'), 'vpn_gateways')
     attempt = 0
     while attempt <= 5 and remaining_vpn_gateways:
         for vpn_gateway in remaining_vpn_gateways:
+            if is_deleting(vpn_gateway):
+                continue
             try:
                 logging.warning(
-                    f"VPN Gateway {vpn_gateway['id']} stuck in state {vpn_gateway['status']}.")
+                    f"VPN Gateway {vpn_gateway.id} stuck in state {vpn_gateway.status}.")
                 logging.warning(
-                    f"Retrying delete of VPN Gateway {vpn_gateway['id']} for attempt {attempt}.")
-                service.delete_vpn_gateway(vpn_gateway['id'])
+                    f"Retrying delete of VPN Gateway {vpn_gateway.id} for attempt {attempt}.")
+                service.delete_vpn_gateway(vpn_gateway.id)
             except ApiException as e:
                 logging.error(
                     f"Delete VPN Gateway failed with code {e.code}: {e.message}")
         attempt += 1
-        sleep(15)
-        remaining_vpn_gateways = get_vpn_gateways(service)
+        remaining_vpn_gateways = wait_for_retry(partial(inventory.refresh, 'vpn_gateways'))
 
     if remaining_vpn_gateways:
         for vpn_gateway in remaining_vpn_gateways:
             logging.error(
-                f"VPN Gateway {vpn_gateway['id']} could not be deleted. Investigate.")
+                f"VPN Gateway {vpn_gateway.id} could not be deleted. Investigate.")
     else:
         logging.info("All VPN Gateways deleted successfully.")
 
 
 def get_load_balancers(service):
-    load_balancers = service.list_load_balancers(
-        limit=100).get_result()['load_balancers']
-    response = []
-    if not load_balancers:
-        return []
-
-    for load_balancer in load_balancers:
-        response.append(load_balancer)
-    return response
+    return paginate(service.list_load_balancers, 'load_balancers')
 
 
-def delete_load_balancers(service):
-    load_balancers = get_load_balancers(service)
+def delete_load_balancers(service, inventory):
+    load_balancers = inventory.get('load_balancers')
     for load_balancer in load_balancers:
         try:
             logging.info(
-                f"Deleting load balancer {load_balancer['id']} in resource group: {load_balancer['resource_group']['id']}")
-            service.delete_load_balancer(load_balancer['id'])
+                f"Deleting load balancer {load_balancer.id} in resource group: {load_balancer.resource_group}")
+            service.delete_load_balancer(load_balancer.id)
         except ApiException as e:
             logging.error(
                 f"Delete load balancer failed with code {e.code}: {e.message}")
 
-    if load_balancers:
-        logging.info("sleeping 120")
-        sleep(120)
-
-    remaining_load_balancers = get_load_balancers(service)
+    remaining_load_balancers = wait_for_deletion(
+        partial(inventory.refresh, 'load_balancers'), 'load_balancers')
     attempt = 0
     while attempt <= 5 and remaining_load_balancers:
         for load_balancer in remaining_load_balancers:
             try:
                 logging.warning(
-                    f"Load balancer {load_balancer['id']} stuck in state {load_balancer['provisioning_status']} ({attempt}).")
-                if load_balancer['provisioning_status'] in {'active', 'failed'}:
+                    f"Load balancer {load_balancer.id} stuck in state {load_balancer.status} ({attempt}).")
+                if load_balancer.status in {'active', 'failed'}:
                     logging.warning(
-                        f"Retrying delete of load balancer {load_balancer['id']} for attempt {attempt}.")
-                    service.delete_load_balancer(load_balancer['id'])
+                        f"Retrying delete of load balancer {load_balancer.id} for attempt {attempt}.")
+                    service.delete_load_balancer(load_balancer.id)
             except ApiException as e:
                 logging.error(
                     f"Delete load balancer failed with code {e.code}: {e.message}")
         attempt += 1
-        sleep(30)
-        remaining_load_balancers = get_load_balancers(service)
+        remaining_load_balancers = wait_for_retry(
+            partial(inventory.refresh, 'load_balancers'), deadline=30)
 
     if remaining_load_balancers:
         for load_balancer in remaining_load_balancers:
             logging.error(
-                f"Load balancer {load_balancer['id']} could not be deleted. Investigate.")
+                f"Load balancer {load_balancer.id} could not be deleted. Investigate.")
     else:
         logging.info("All load balancers deleted successfully.")
 
 
 def get_endpoint_gateways(service):
     try:
-        endpoint_gateways = service.list_endpoint_gateways(
-            limit=100).get_result()['endpoint_gateways']
-        response = []
-        for endpoint_gateway in endpoint_gateways:
-            response.append(endpoint_gateway)
-        return response
+        yield from paginate(service.list_endpoint_gateways, 'endpoint_gateways')
     except Exception as e:
         logging.error(f"Get endpoint gateways failed with {e}", stack_info=True)
 
 
-def delete_endpoint_gateways(service):
-    endpoint_gateways = get_endpoint_gateways(service)
+def delete_endpoint_gateways(service, inventory):
+    endpoint_gateways = inventory.get('endpoint_gateways')
     for endpoint_gateway in endpoint_gateways:
         try:
             logging.info(
-                f"Deleting endpoint gateway {endpoint_gateway['id']} in VPC: {endpoint_gateway['vpc']['id']} resource group: {endpoint_gateway['resource_group']['id']}")
-            service.delete_endpoint_gateway(endpoint_gateway['id'])
+                f"Deleting endpoint gateway {endpoint_gateway.id} in VPC: {endpoint_gateway.vpc_id} resource group: {endpoint_gateway.resource_group}")
+            service.delete_endpoint_gateway(endpoint_gateway.id)
         except ApiException as e:
             logging.error(
                 f"Delete endpoint gateway failed with code {e.code}: {e.message}")
 
-    if len(endpoint_gateways) > 0:
-        sleep(30)
-
-    remaining_endpoint_gateways = get_endpoint_gateways(service)
+    remaining_endpoint_gateways = wait_for_deletion(
+        partial(inventory.refresh, 'endpoint_gateways'), 'endpoint_gateways')
     attempt = 0
     while attempt <= 5 and remaining_endpoint_gateways:
         for endpoint_gateway in remaining_endpoint_gateways:
+            if is_deleting(endpoint_gateway):
+                continue
             try:
                 logging.warning(
-                    f"Endpoint gateway {endpoint_gateway['id']} stuck in state {endpoint_gateway['lifecycle_state']}.")
+                    f"Endpoint gateway {endpoint_gateway.id} stuck in state {endpoint_gateway.status}.")
                 logging.warning(
-                    f"Retrying delete of endpoint gateway {endpoint_gateway['id']} for attempt {attempt}.")
-                service.delete_endpoint_gateway(endpoint_gateway['id'])
+                    f"Retrying delete of endpoint gateway {endpoint_gateway.id} for attempt {attempt}.")
+                service.delete_endpoint_gateway(endpoint_gateway.id)
             except ApiException as e:
                 logging.error(
                     f"Delete endpoint gateway failed with code {e.code}: {e.message}")
         attempt += 1
-        sleep(15)
-        remaining_endpoint_gateways = get_endpoint_gateways(service)
+        remaining_endpoint_gateways = wait_for_retry(
+            partial(inventory.refresh, 'endpoint_gateways'))
 
     if remaining_endpoint_gateways:
         for endpoint_gateway in remaining_endpoint_gateways:
             logging.error(
-                f"Endpoint gateway {endpoint_gateway['id']} could not be deleted. Investigate.")
+                f"Endpoint gateway {endpoint_gateway.id} could not be deleted. Investigate.")
     else:
         logging.info("All endpoint gateways deleted successfully.")
 
@@ -588,8 +613,7 @@ def get_flow_log_collectors(service):
     """
 
     try:
-        flow_log_collectors = service.list_flow_log_collectors(limit=100).get_result()[
-            'flow_log_collectors']
+        flow_log_collectors = list(paginate(service.list_flow_log_collectors, 'flow_log_collectors'))
 
         if flow_log_collectors:
             logging.warning("The following flow log collectors exist:")
@@ -613,309 +637,615 @@ def delete_flow_log_collectors(service):
 
 def get_subnets(service):
     try:
-        subnets = service.list_subnets().get_result()['subnets']
-        response = []
-        for subnet in subnets:
-            response.append(subnet)
-        return response
+        yield from paginate(service.list_subnets, 'subnets')
     except ApiException as e:
         if e.code == 502:
-            return []
+            return
 
         logging.error(f"Get subnets failed with {e.code}", stack_info=True)
-        return []
 
 
-def delete_subnets(service):
-    subnets = get_subnets(service)
+def delete_subnets(service, inventory):
+    subnets = inventory.get('subnets')
     for subnet in subnets:
         try:
             logging.info(
-                f"Deleting subnet {subnet['id']} in VPC: {subnet['vpc']['id']} resource group: {subnet['resource_group']['id']}")
-            service.delete_subnet(subnet['id'])
+                f"Deleting subnet {subnet.id} in VPC: {subnet.vpc_id} resource group: {subnet.resource_group}")
+            service.delete_subnet(subnet.id)
         except ApiException as e:
             logging.error(
                 f"Delete subnet failed with code {e.code}: {e.message}")
 
-    if subnets:
-        sleep(30)
-
-    remaining_subnets = get_subnets(service)
+    remaining_subnets = wait_for_deletion(partial(inventory.refresh, 'subnets'), 'subnets')
     attempt = 0
     while attempt <= 5 and remaining_subnets:
         for subnet in remaining_subnets:
+            if is_deleting(subnet):
+                continue
             try:
                 logging.warning(
-                    f"Subnet {subnet['id']} stuck in state {subnet['status']}.")
+                    f"Subnet {subnet.id} stuck in state {subnet.status}.")
                 logging.warning(
-                    f"Retrying delete of subnet {subnet['id']} for attempt {attempt}.")
-                service.delete_subnet(subnet['id'])
+                    f"Retrying delete of subnet {subnet.id} for attempt {attempt}.")
+                service.delete_subnet(subnet.id)
             except ApiException as e:
                 logging.error(
                     f"Delete subnet failed with code {e.code}: {e.message}")
         attempt += 1
-        sleep(15)
-        remaining_subnets = get_subnets(service)
+        remaining_subnets = wait_for_retry(partial(inventory.refresh, 'subnets'))
 
     if remaining_subnets:
         for subnet in remaining_subnets:
             logging.error(
-                f"Subnet {subnet['id']} could not be deleted. Investigate.")
+                f"Subnet {subnet.id} could not be deleted. Investigate.")
     else:
         logging.info("All Subnets deleted successfully.")
 
 
 def get_vpcs(service):
-    vpcs = service.list_vpcs().get_result()['vpcs']
-    response = []
-    for vpc in vpcs:
-        response.append(vpc)
-    return response
+    return paginate(service.list_vpcs, 'vpcs')
 
 
-def delete_vpcs(service):
-    vpcs = get_vpcs(service)
+def delete_vpcs(service, inventory):
+    vpcs = inventory.get('vpcs')
     for vpc in vpcs:
         try:
             logging.info(
-                f"Deleting VPC {vpc['id']} in resource group: {vpc['resource_group']['id']}")
-            service.delete_vpc(vpc['id'])
+                f"Deleting VPC {vpc.id} in resource group: {vpc.resource_group}")
+            service.delete_vpc(vpc.id)
         except ApiException as e:
             logging.error(f"Delete VPC failed with code {e.code}: {e.message}")
 
-    if vpcs:
-        sleep(30)
-
-    remaining_vpcs = get_vpcs(service)
+    remaining_vpcs = wait_for_deletion(partial(inventory.refresh, 'vpcs'), 'vpcs')
     attempt = 0
     while attempt <= 5 and remaining_vpcs:
         for vpc in remaining_vpcs:
+            if is_deleting(vpc):
+                continue
             try:
                 logging.warning(
-                    f"VPC {vpc['id']} stuck in state {vpc['status']}.")
+                    f"VPC {vpc.id} stuck in state {vpc.status}.")
                 logging.warning(
-                    f"Retrying delete of VPC {vpc['id']} for attempt {attempt}.")
-                service.delete_vpc(vpc['id'])
+                    f"Retrying delete of VPC {vpc.id} for attempt {attempt}.")
+                service.delete_vpc(vpc.id)
             except ApiException as e:
                 logging.error(
                     f"Delete VPC failed with code {e.code}: {e.message}")
         attempt += 1
-        sleep(15)
-        remaining_vpcs = get_vpcs(service)
+        remaining_vpcs = wait_for_retry(partial(inventory.refresh, 'vpcs'))
 
     if remaining_vpcs:
         for vpc in remaining_vpcs:
             logging.error(
-                f"VPC {vpc['id']} could not be deleted. Investigate.")
+                f"VPC {vpc.id} could not be deleted. Investigate.")
     else:
         logging.info("All VPCs deleted successfully.")
 
 
 def get_security_groups(service):
-    security_groups = service.list_security_groups().get_result()[
-        'security_groups']
-    response = []
-    for sg in security_groups:
-        response.append(sg)
-    return response
+    return paginate(service.list_security_groups, 'security_groups')
 
 
-def delete_security_groups(service):
-    security_groups = get_security_groups(service)
+def delete_security_groups(service, inventory):
+    security_groups = inventory.get('security_groups')
     for sg in security_groups:
         try:
             logging.info(
-                f"Deleting security group {sg['id']} in resource group: {sg['resource_group']['id']}")
-            service.delete_security_group(sg['id'])
+                f"Deleting security group {sg.id} in resource group: {sg.resource_group}")
+            service.delete_security_group(sg.id)
         except ApiException as e:
             logging.error(
                 f"Delete security group failed with code {e.code}: {e.message}")
 
-    if security_groups:
-        sleep(15)
-
-    remaining_security_groups = get_security_groups(service)
+    remaining_security_groups = wait_for_deletion(
+        partial(inventory.refresh, 'security_groups'), 'security_groups')
     attempt = 0
     while attempt <= 5 and remaining_security_groups:
         for sg in remaining_security_groups:
             try:
                 logging.warning(
-                    f"Retrying delete of security group {sg['id']} for attempt {attempt}.")
-                service.delete_security_group(sg['id'])
+                    f"Retrying delete of security group {sg.id} for attempt {attempt}.")
+                service.delete_security_group(sg.id)
             except ApiException as e:
                 logging.error(
                     f"Delete security group failed with code {e.code}: {e.message}")
         attempt += 1
-        sleep(15)
-        remaining_security_groups = get_security_groups(service)
+        remaining_security_groups = wait_for_retry(partial(inventory.refresh, 'security_groups'))
 
     if remaining_security_groups:
         for sg in remaining_security_groups:
             logging.error(
-                f"Security group {sg['id']} could not be deleted. Investigate.")
+                f"Security group {sg.id} could not be deleted. Investigate.")
     else:
         logging.info("All security groups deleted successfully.")
 
 
 def get_rhoic_clusters(api_key):
-    token = get_token(api_key)
-    http = urllib3.PoolManager()
-    url = "https://containers.cloud.ibm.com/global/v2/vpc/getClusters"
-    headers = {"Authorization": "Bearer " + token}
+    url = f"{CONTAINERS_URL}/global/v2/vpc/getClusters"
     logging.info("Getting the list of RHOIC clusters")
-    rhoic_clusters = http.request(
+    rhoic_clusters = http_client.request_json_with_token(
         'GET',
         url,
-        headers=headers
-    ).data.decode('utf-8')
-    rhoic_clusters = json.loads(rhoic_clusters)
+        partial(get_token, api_key),
+        partial(invalidate_token, api_key),
+        operation='get_clusters'
+    )
 
     return rhoic_clusters
 
 
-def delete_rhoic_clusters(api_key):
-    rhoic_clusters = get_rhoic_clusters(api_key)
+def delete_rhoic_cluster(api_key, cluster):
+    url = f"{CONTAINERS_URL}/global/v1/clusters/{cluster['id']}?deleteResources=True"
+    logging.info(f"Deleting the RHOIC cluster {cluster['id']}")
+    http_client.request_with_token(
+        'DELETE',
+        url,
+        partial(get_token, api_key),
+        partial(invalidate_token, api_key),
+        operation='delete_cluster'
+    )
+
+
+def delete_rhoic_clusters(api_key, rhoic_clusters=None, list_clusters=None):
+    """Delete the RHOIC clusters and wait for them to go away. Returns the clusters left over."""
+    list_clusters = list_clusters or partial(get_rhoic_clusters, api_key)
+    if rhoic_clusters is None:
+        rhoic_clusters = list_clusters()
     rhoic_cluster_deleted = False
     for cluster in rhoic_clusters:
         if cluster['state'] != 'deleting':
-            token = get_token(api_key)
-            http = urllib3.PoolManager()
-            url = f"https://containers.cloud.ibm.com/global/v1/clusters/{cluster['id']}?deleteResources=True"
-            headers = {"Authorization": "Bearer " + token}
-            logging.info(f"Deleting the RHOIC cluster {cluster['id']}")
-            http.request(
-                'DELETE',
-                url,
-                headers=headers
-            )
+            delete_rhoic_cluster(api_key, cluster)
             rhoic_cluster_deleted = True
 
     if rhoic_cluster_deleted:
         logging.info(
-            "Sleeping for 10 minutes to wait for RHOIC clusters to delete")
-        sleep(600)
+            "Waiting up to 10 minutes for RHOIC clusters to delete")
+        remaining_rhoic_clusters = wait_for_retry(list_clusters, deadline=WAIT_DEADLINES['rhoic_clusters'])
+    else:
+        remaining_rhoic_clusters = list_clusters()
 
-    remaining_rhoic_clusters = get_rhoic_clusters(api_key)
     attempt = 0
     while attempt <= 5 and remaining_rhoic_clusters:
         logging.info(
-            f"Pausing 60 seconds for RHOIC cleanup attempt #{attempt}")
-        sleep(60)
+            f"Waiting up to 60 seconds for RHOIC cleanup attempt #{attempt}")
         attempt += 1
-        remaining_rhoic_clusters = get_rhoic_clusters(api_key)
+        remaining_rhoic_clusters = wait_for_retry(list_clusters, deadline=60)
 
     if remaining_rhoic_clusters:
         logging.error("RHOIC clusters could not be cleaned up")
     else:
         logging.info("No RHOIC clusters found.")
+    return remaining_rhoic_clusters
+
 
+class RhoicTeardown:
+    """
+    Deletes the RHOIC clusters of an account in the background.
+
+    The clusters are listed up front so the regions they live in are known,
+    then deleted and polled on a worker thread. wait_for_region() blocks
+    until no cluster of the region is left, so region cleanup only joins on
+    the teardown before the resources the clusters sit on.
+    """
 
-def delete_cos_instance(resource_controller, resource):
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.regions = set()
+        self.remaining = []
+        self._region_events = {}
+        self._future = None
+
+    def start(self, executor):
+        clusters = get_rhoic_clusters(self.api_key)
+        # Clusters without a region could live anywhere; they are keyed
+        # under None and every region waits for them.
+        self.regions = {cluster.get('region') for cluster in clusters}
+        self._region_events = {region: threading.Event() for region in self.regions}
+        if clusters:
+            logging.info(f"Deleting RHOIC clusters in the background in regions: {sorted(map(str, self.regions))}")
+            self._future = submit_with_context(executor, self._run, clusters)
+        else:
+            logging.info("No RHOIC clusters found.")
+        return self
+
+    def _list_clusters(self):
+        clusters = get_rhoic_clusters(self.api_key)
+        remaining_regions = {cluster.get('region') for cluster in clusters}
+        for region, event in self._region_events.items():
+            if region not in remaining_regions:
+                event.set()
+        return clusters
+
+    def _run(self, clusters):
+        try:
+            with report.step('rhoic_teardown'):
+                self.remaining = delete_rhoic_clusters(self.api_key, clusters, self._list_clusters)
+        except Exception:
+            self.remaining = clusters
+            raise
+        finally:
+            for event in self._region_events.values():
+                event.set()
+
+    def wait_for_region(self, region):
+        """
+        Block until the clusters of the region are gone; raise if the teardown left some behind.
+
+        Returns whether the region had clusters to wait for.
+        """
+        waited = False
+        for key in (region, None):
+            if key in self._region_events:
+                logging.info(f"Waiting for RHOIC clusters in region {region} to delete")
+                self._region_events[key].wait()
+                waited = True
+        left_over = [cluster['id'] for cluster in self.remaining if cluster.get('region') in (region, None)]
+        if left_over:
+            raise RuntimeError(f"RHOIC clusters still present: {', '.join(left_over)}")
+        return waited
+
+    def join(self):
+        """Wait for the teardown to finish and return the clusters left over."""
+        if self._future:
+            self._future.result()
+        return self.remaining
+
+
+def get_pending_resource_instances(resource_controller, resources, max_workers=8):
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        checks = [submit_with_context(executor, get_resource_instance, resource_controller, resource)
+                  for resource in resources]
+    instances = [check.result() for check in checks]
+    return [instance for instance in instances if instance and instance['state'] != 'removed']
+
+
+def delete_resource_instance(resource_controller, crn):
     try:
-        logging.info(f"Deleting COS instance {resource}")
-        resource_controller.delete_resource_instance(resource, recursive=True)
+        logging.info(f"Deleting resource instance {crn}")
+        resource_controller.delete_resource_instance(crn, recursive=True)
     except ApiException as e:
         logging.error(
             f"Delete resource instance failed with code {e.code}: {e.message}")
 
-    logging.info("Pausing 20s for COS instances to delete")
-    sleep(20)
 
-    cos_instance = resource_controller.get_resource_instance(
-        resource).get_result()
+def delete_resource_instances(resource_controller, crns, resource_type, max_workers=8):
+    """Send every delete at once, then poll all instances together until removed or the deadline passes."""
+    if not crns:
+        return []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        deletes = {submit_with_context(executor, delete_resource_instance, resource_controller, crn): crn
+                   for crn in crns}
+    # delete_resource_instance only handles ApiException; anything else,
+    # such as a timeout, is logged here instead of being lost.
+    for delete, crn in deletes.items():
+        try:
+            delete.result()
+        except Exception as e:
+            logging.error(f"Delete resource instance {crn} failed with {e}")
+
+    logging.info(f"Waiting up to {WAIT_DEADLINES[resource_type]}s for {len(crns)} {resource_type} to delete")
+    pending = wait_for_deletion(
+        partial(get_pending_resource_instances, resource_controller, crns), resource_type, status_key=None)
+
+    pending_crns = {instance['crn'] for instance in pending}
+    for crn in crns:
+        if crn in pending_crns:
+            logging.warning(f"Resource instance {crn} may not be deleted. Investigate")
+        else:
+            logging.info(f"Resource instance {crn} deleted successfully.")
+    return pending
 
-    if cos_instance['state'] != 'removed':
-        logging.warning(
-            f"COS instance {cos_instance['crn']} may not be deleted. Investigate"
-        )
-    else:
-        logging.info(
-            f"COS instance {cos_instance['crn']} deleted successfully.")
 
+def is_ignored(resource):
+    return any(i in resource['id'] for i in IGNORED_RESOURCES)
 
-def get_all_resources(resource_controller, resource_groups):
-    resource_list = []
-    for rg in resource_groups:
-        resources = resource_controller.list_resource_instances(
-            resource_group_id=rg).get_result()['resources']
-        if resources:
-            for resource in resources:
-                logging.warning(
-                    f"Resource group {rg} still has resources: {resource['resource_id']}: {resource['id']}")
-                resource_list.append(resource)
-        else:
-            logging.info(f"No resources in resource group {rg}")
-    # The security advisor resources cannot be deleted, so we
-    # will exclude them from the list
-    ignore_resource = ['security-advisor', 'schematics']
-    response = [res for res in resource_list if all(i not in res['id'] for i in ignore_resource)]
-    return response
 
+def is_vpc_instance(resource):
+    # Resource controller mirrors of VPC infrastructure carry the 'is'
+    # service name in their CRN and disappear with the region sweep.
+    return resource['crn'].split(':')[4] == 'is'
 
-def clean(api_key=None):
-    if api_key is None:
-        logging.error("API key must be provided.")
-        return None
 
-    authenticator = IAMAuthenticator(api_key)
-    resource_manager = ResourceManagerV2(authenticator=authenticator)
-    resource_groups = get_resource_groups(resource_manager)
+def list_resource_instances(resource_controller, resource_groups, max_workers=8):
+    """Stream the resource instances of all resource groups, listed concurrently and without ignored ones."""
+    def list_group(rg):
+        return [resource for resource in paginate(resource_controller.list_resource_instances, 'resources',
+                                                  resource_group_id=rg)
+                if not is_ignored(resource)]
 
-    # RHOIC is global, so this is being deleted before looping
-    # through the regions
-    delete_rhoic_clusters(api_key)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        listings = [submit_with_context(executor, list_group, rg) for rg in resource_groups]
+        for listing in as_completed(listings):
+            yield from listing.result()
 
-    service = VpcV1(authenticator=authenticator, generation=2)
 
-    regions = service.list_regions().get_result()['regions']
-    for region in regions:
-        # This region is causing a error 502
-        if region['name'] == 'ca-tor':
+def get_resource_instance(resource_controller, resource_id):
+    try:
+        return resource_controller.get_resource_instance(resource_id).get_result()
+    except ApiException as e:
+        if e.code == 404:
+            return None
+        raise
+
+
+def new_resource_instance_inventory(resource_controller, resource_groups):
+    return ResourceInstanceInventory(partial(list_resource_instances, resource_controller, resource_groups),
+                                     partial(get_resource_instance, resource_controller))
+
+
+def report_resources(resource_list):
+    for resource in resource_list:
+        logging.warning(
+            f"Resource group {resource['resource_group_id']} still has resources: "
+            f"{resource['resource_id']}: {resource['id']}")
+    return resource_list
+
+
+def get_all_resources(resource_controller, resource_groups):
+    return report_resources(list(list_resource_instances(resource_controller, resource_groups)))
+
+
+# Resource types that must be drained from a region before a given type
+# can be deleted. Types without real prerequisites (keys, images, ...)
+# start as soon as the region is processed. Floating IPs wait for the
+# public gateways, which hold on to the floating IP they were given.
+REGION_DEPENDENCIES = {
+    'rhoic_clusters': [],
+    'instance_groups': [],
+    'instance_templates': ['instance_groups'],
+    'instances': ['instance_groups', 'rhoic_clusters'],
+    'volumes': ['instances'],
+    'keys': [],
+    'images': [],
+    'vpn_gateways': [],
+    'load_balancers': ['rhoic_clusters'],
+    'endpoint_gateways': ['rhoic_clusters'],
+    'flow_log_collectors': [],
+    'subnets': ['instances', 'vpn_gateways', 'load_balancers', 'endpoint_gateways'],
+    'public_gateways': ['subnets'],
+    'floating_ips': ['public_gateways'],
+    'vpcs': ['instance_templates', 'subnets', 'public_gateways'],
+    'security_groups': ['vpcs'],
+}
+
+
+# Listers used to build the region inventory: (lister, status field,
+# field holding references the cleaner needs, e.g. instance group managers).
+INVENTORY_LISTERS = {
+    'instance_groups': (get_instance_groups, 'status', 'managers'),
+    'instance_templates': (get_instance_templates, None, None),
+    'instances': (get_instances, 'status', None),
+    'volumes': (get_volumes, 'status', None),
+    'keys': (get_keys, None, None),
+    'images': (get_images, 'status', None),
+    'vpn_gateways': (get_vpn_gateways, 'status', None),
+    'load_balancers': (get_load_balancers, 'provisioning_status', None),
+    'endpoint_gateways': (get_endpoint_gateways, 'lifecycle_state', None),
+    'subnets': (get_subnets, 'status', None),
+    'public_gateways': (get_public_gateways, 'status', None),
+    'floating_ips': (get_floating_ips, 'status', None),
+    'vpcs': (get_vpcs, 'status', None),
+    'security_groups': (get_security_groups, None, None),
+}
+
+
+def load_inventory(service, region_name, skip_types=()):
+    listers = {name: (partial(lister, service), status_key, refs_key)
+               for name, (lister, status_key, refs_key) in INVENTORY_LISTERS.items() if name not in skip_types}
+    return RegionInventory(region_name, listers).load()
+
+
+def skip_step():
+    pass
+
+
+# Resource types a cluster teardown with deleteResources=True removes
+# along with the cluster: its workers and their volumes, its load
+# balancers, VPE gateways and security groups.
+RHOIC_RESOURCE_TYPES = ['instances', 'volumes', 'load_balancers', 'endpoint_gateways', 'security_groups']
+
+
+def wait_for_rhoic(rhoic, inventory, region_name, before):
+    """
+    Wait for the RHOIC teardown of the region, then re-list what it removed
+    so the later steps neither delete it again nor count it as deleted.
+    """
+    if not rhoic.wait_for_region(region_name):
+        return
+    for name in RHOIC_RESOURCE_TYPES:
+        if name not in inventory.listers:
+            continue
+        try:
+            ids = {record.id for record in inventory.refresh(name)}
+        except Exception as e:
+            logging.warning(f"Re-listing {name} after the RHOIC teardown failed with {e}")
             continue
+        if before is not None and name in before:
+            before[name] &= ids
+
+
+def get_region_steps(service, inventory, resource_groups, region_name=None, rhoic=None, before=None):
+    return {
+        'rhoic_clusters': partial(wait_for_rhoic, rhoic, inventory, region_name, before) if rhoic else skip_step,
+        'instance_groups': partial(delete_instance_groups, service, inventory),
+        'instance_templates': partial(delete_instance_templates, service, inventory),
+        'instances': partial(delete_instances, service, inventory),
+        'volumes': partial(delete_volumes, service, inventory),
+        'keys': partial(delete_keys, service, inventory),
+        'images': partial(delete_images, service, inventory, resource_groups),
+        'vpn_gateways': partial(delete_vpn_gateways, service, inventory),
+        'load_balancers': partial(delete_load_balancers, service, inventory),
+        'endpoint_gateways': partial(delete_endpoint_gateways, service, inventory),
+        'flow_log_collectors': partial(get_flow_log_collectors, service),
+        'subnets': partial(delete_subnets, service, inventory),
+        'public_gateways': partial(delete_public_gateways, service, inventory),
+        'floating_ips': partial(delete_floating_ips, service, inventory),
+        'vpcs': partial(delete_vpcs, service, inventory),
+        'security_groups': partial(delete_security_groups, service, inventory),
+    }
+
 
-        base_url = region['endpoint'] + '/v1'
-        service.set_service_url(base_url)
+def record_region(checkpoint, region_name, before, after, step_results):
+    """Record in the checkpoint what the region steps deleted and which types are now empty."""
+    deleted = {name: sorted(ids - after.get(name, ids)) for name, ids in before.items()}
+    empty_types = [name for name, ids in after.items() if not ids and step_results.get(name, 'done') == 'done']
+    done = all(result == 'done' for result in step_results.values()) and len(empty_types) == len(after)
+    checkpoint.record_region(region_name, empty_types, deleted, done)
+    for name, ids in deleted.items():
+        report.record_resources('deleted', name, len(ids))
+    for name, ids in after.items():
+        report.record_resources('stuck', name, len(ids))
+
+
+def clean_region(authenticator, region, resource_groups, checkpoint, checkpoint_store=None, rhoic=None,
+                 max_parallel_steps=4):
+    with report.region(region['name']):
+        # Each worker gets its own client so that set_service_url() does not
+        # race with the other regions being processed in parallel.
+        service = new_vpc_service(authenticator, region['endpoint'] + '/v1', region['name'])
+        # Types a previous run confirmed empty are neither listed nor deleted again.
+        confirmed_empty = checkpoint.types_empty(region['name'])
+        # One listing pass per region; the delete steps start from this
+        # snapshot and only re-list their own type while waiting.
+        with report.step('inventory'):
+            inventory = load_inventory(service, region['name'], confirmed_empty)
+        before = inventory.snapshot()
+        if inventory.is_empty():
+            logging.info(f"Skipping region {region['name']}: no resources found.")
+            CleanUpSandboxMetrics.push_region_decision(region['name'], 'skip')
+            record_region(checkpoint, region['name'], before, before, {})
+            save_checkpoint(checkpoint_store, checkpoint)
+            return
+
+        logging.info(f"Region {region['name']} has resources in: {', '.join(inventory.non_empty_types())}")
+        CleanUpSandboxMetrics.push_region_decision(region['name'], 'clean')
         logging.info(f"Processing region: {region['endpoint']}")
-        delete_instance_groups(service)
-        delete_instance_templates(service)
-        delete_instances(service)
-        delete_volumes(service)
-        delete_keys(service)
-        delete_images(service, resource_groups)
-        delete_vpn_gateways(service)
-        delete_load_balancers(service)
-        delete_endpoint_gateways(service)
-        get_flow_log_collectors(service)
-        delete_subnets(service)
-        delete_public_gateways(service)
-        delete_floating_ips(service)
-        delete_vpcs(service)
-        delete_security_groups(service)
-
-    logging.info("Sleeping for 60s to let resource controller catch up.")
-    sleep(60)
+        steps = get_region_steps(service, inventory, resource_groups, region['name'], rhoic, before)
+        for name in confirmed_empty:
+            steps[name] = skip_step
+        steps = {name: report.timed_step(name, func) for name, func in steps.items()}
+        step_results = run_graph(steps, REGION_DEPENDENCIES, max_parallel_steps)
+        record_region(checkpoint, region['name'], before, inventory.snapshot(), step_results)
+        save_checkpoint(checkpoint_store, checkpoint)
+        failed_steps = [name for name, result in step_results.items() if result != 'done']
+        if failed_steps:
+            raise RuntimeError(f"steps did not finish: {', '.join(sorted(failed_steps))}")
+
+
+def clean_regions(authenticator, regions, resource_groups, checkpoint, checkpoint_store=None, rhoic=None,
+                  max_parallel_regions=1):
+    region_results = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_parallel_regions)) as executor:
+        futures = {
+            submit_with_context(executor, clean_region, authenticator, region, resource_groups,
+                                checkpoint, checkpoint_store, rhoic): region['name']
+            for region in regions
+        }
+        for future in as_completed(futures):
+            region_name = futures[future]
+            try:
+                future.result()
+                region_results[region_name] = 'cleaned'
+                logging.info(f"Finished processing region {region_name}")
+            except Exception as e:
+                region_results[region_name] = f"failed: {e}"
+                logging.error(f"Processing region {region_name} failed with {e}")
+    return region_results
 
-    resource_controller = ResourceControllerV2(authenticator=authenticator)
-    resource_list = get_all_resources(resource_controller, resource_groups)
 
-    logging.info("Processing cloud object storage instances")
-    for resource in resource_list:
-        if 'cloud-object-storage' in resource['crn']:
-            delete_cos_instance(resource_controller, resource['crn'])
+def raise_not_clean(failed_regions, rhoic_left):
+    problems = []
+    if failed_regions:
+        problems.append(f"regions not cleaned: {', '.join(failed_regions)}")
+    if rhoic_left:
+        problems.append(f"RHOIC clusters left: {', '.join(cluster['id'] for cluster in rhoic_left)}")
+    raise RuntimeError(f"Account not fully cleaned; {'; '.join(problems)}")
+
 
-    resource_list = get_all_resources(resource_controller, resource_groups)
+def clean(api_key=None, max_parallel_regions=1, checkpoint_store=None, account_name=None):
+    if api_key is None:
+        logging.error("API key must be provided.")
+        return None
+
+    with report.reporting(account_name) as cleanup_report:
+        try:
+            return run_cleanup(api_key, max_parallel_regions, checkpoint_store, account_name)
+        finally:
+            cleanup_report.publish()
+
+
+def run_cleanup(api_key, max_parallel_regions, checkpoint_store, account_name):
+    with report.phase('setup'):
+        checkpoint = load_checkpoint(checkpoint_store, account_name)
+        authenticator = get_authenticator(api_key)
+        resource_manager = new_resource_manager(authenticator)
+        resource_groups = get_resource_groups(resource_manager)
+
+    # The resource controller listing runs alongside the RHOIC and region
+    # work; afterwards only the instances it found are checked again.
+    resource_controller = new_resource_controller(authenticator)
+    with ThreadPoolExecutor(max_workers=2) as background:
+        resource_instances = new_resource_instance_inventory(resource_controller, resource_groups).start(background)
+
+        # RHOIC clusters are torn down in the background; the regions they
+        # use wait for them before deleting the VPC resources they sit on.
+        rhoic = None
+        if not checkpoint.phase_done('rhoic'):
+            rhoic = RhoicTeardown(api_key).start(background)
+
+        with report.phase('regions'):
+            regions = [region for region in get_regions(new_vpc_service(authenticator))
+                       if not checkpoint.region_done(region['name'])]
+            region_results = clean_regions(authenticator, regions, resource_groups, checkpoint, checkpoint_store,
+                                           rhoic, max_parallel_regions)
+        logging.info(f"Region results: {region_results}")
+        failed_regions = sorted(name for name, result in region_results.items() if result != 'cleaned')
+        with report.phase('rhoic_join'):
+            rhoic_left = rhoic.join() if rhoic else []
+        if not rhoic_left:
+            regions_cleaned = all(result == 'cleaned' for result in region_results.values())
+            checkpoint.set_phase('resources' if regions_cleaned else 'regions')
+            save_checkpoint(checkpoint_store, checkpoint)
+
+    logging.info("Waiting for resource controller to catch up with the VPC deletions.")
+    with report.phase('resource_controller_wait'), report.step('resource_controller'):
+        # Only the VPC mirrors are polled; the other instances are deleted below.
+        wait_for_deletion(lambda: [resource for resource in resource_instances.recheck(is_vpc_instance)
+                                   if is_vpc_instance(resource)],
+                          'resource_controller', status_key='state')
+        resource_list = resource_instances.get()
+
+    with report.phase('resource_instances'):
+        for resource_type, crn_fragment in RESOURCE_INSTANCE_TYPES.items():
+            logging.info(f"Processing {resource_type}")
+            with report.step(resource_type):
+                crns = [resource['crn'] for resource in resource_list if crn_fragment in resource['crn']]
+                left = delete_resource_instances(resource_controller, crns, resource_type)
+            report.record_resources('deleted', resource_type, len(crns) - len(left))
+            report.record_resources('stuck', resource_type, len(left))
+
+    with report.phase('final_check'):
+        resource_list = report_resources(resource_instances.recheck())
+    # Failed regions and leftover clusters may hold resources the resource
+    # controller does not show, so the account is not clean and its
+    # checkpoint is kept for the next run.
+    if failed_regions or rhoic_left:
+        raise_not_clean(failed_regions, rhoic_left)
+    if not resource_list:
+        clear_checkpoint(checkpoint_store, account_name)
     return resource_list
 
 
 if __name__ == "__main__":
-    logging.basicConfig(stream=sys.stdout, level=logging.INFO,
-                        format='%(asctime)s %(module)s %(levelname)s %(message)s', datefmt='%Y-%m-%dT%H:%M:%S%z')
+    configure_logging()
     parser = argparse.ArgumentParser("Create and update IBM Cloud accounts.")
     parser.add_argument("--api-key", required=True,
                         help="The API key that will be used to create access token")
+    parser.add_argument("--max-parallel-regions", type=int, default=1,
+                        help="How many regions to clean at the same time.")
     args = parser.parse_args()
 
     if args.api_key:
         api_key = args.api_key
 
-    clean(api_key)
+    clean(api_key, max_parallel_regions=args.max_parallel_regions)
@@ -0,0 +1,33 @@
+import logging
+import os
+from functools import lru_cache
+
+import boto3
+from botocore.config import Config
+
+# Connections the shared client keeps per endpoint. It serves the usage
+# lookups (16 workers) and the checkpoints of the accounts and regions
+# cleaned in parallel, so it must be at least as large as those pools.
+MAX_POOL_CONNECTIONS = int(os.environ.get('DYNAMODB_MAX_POOL_CONNECTIONS', 32))
+
+
+@lru_cache(maxsize=None)
+def get_client():
+    """Return the process-wide DynamoDB client, creating it on first use."""
+    aws_access_key_id = os.environ.get('AWS_ACCESS_KEY_ID')
+    aws_secret_access_key = os.environ.get('AWS_SECRET_ACCESS_KEY')
+    aws_region = os.environ.get('AWS_REGION')
+    endpoint_url = os.environ.get('DYNAMODB_ENDPOINT_URL')
+    config = Config(max_pool_connections=MAX_POOL_CONNECTIONS)
+
+    if aws_access_key_id and aws_secret_access_key and aws_region:
+        aws_session = boto3.Session(
+            aws_access_key_id=aws_access_key_id,
+            aws_secret_access_key=aws_secret_access_key,
+            region_name=aws_region
+            )
+        logging.info("Using production dynamodb.")
+        return aws_session.client('dynamodb', endpoint_url=endpoint_url, config=config)
+
+    logging.info("Using local development dynamodb")
+    return boto3.client('dynamodb', endpoint_url=endpoint_url or 'http://localhost:8000', config=config)
@@ -0,0 +1,66 @@
+import json
+import os
+from time import perf_counter
+from urllib.parse import urlparse
+
+import urllib3
+from metrics import ApiMetrics
+
+CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 60))
+# Connections kept alive per host. Accounts and regions are cleaned in
+# parallel, so this should be at least as large as the worker pools.
+POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 32))
+
+# One pool manager per process so keep-alive connections and TLS sessions
+# to SAA, IAM and the containers API are reused across requests.
+http = urllib3.PoolManager(
+    num_pools=10,
+    maxsize=POOL_MAXSIZE,
+    block=False,
+    timeout=urllib3.Timeout(connect=CONNECT_TIMEOUT, read=READ_TIMEOUT),
+)
+
+
+def request(method, url, operation=None, **kwargs):
+    """Send a request through the shared pool, recording it in ApiMetrics under operation."""
+    operation = operation or f"{method} {urlparse(url).netloc}"
+    start = perf_counter()
+    try:
+        response = http.request(method, url, **kwargs)
+    except Exception:
+        ApiMetrics.record_call(operation, 'global', 'error', perf_counter() - start)
+        raise
+    ApiMetrics.record_call(operation, 'global', response.status, perf_counter() - start)
+    if response.retries and response.retries.history:
+        ApiMetrics.record_retry(operation, 'global', len(response.retries.history))
+    return response
+
+
+def request_with_token(method, url, get_token, invalidate_token, headers=None, **kwargs):
+    """
+    Send a request authorized with the bearer token returned by get_token().
+
+    A cached token can be revoked before it expires, so on a 401 it is
+    dropped with invalidate_token() and the request is sent once more
+    with a fresh one.
+    """
+    headers = dict(headers or {}, Authorization=f"Bearer {get_token()}")
+    response = request(method, url, headers=headers, **kwargs)
+    if response.status == 401:
+        invalidate_token()
+        headers['Authorization'] = f"Bearer {get_token()}"
+        response = request(method, url, headers=headers, **kwargs)
+    return response
+
+
+def decode_json(response):
+    return json.loads(response.data.decode('utf-8'))
+
+
+def request_json(method, url, **kwargs):
+    return decode_json(request(method, url, **kwargs))
+
+
+def request_json_with_token(method, url, get_token, invalidate_token, **kwargs):
+    return decode_json(request_with_token(method, url, get_token, invalidate_token, **kwargs))
@@ -0,0 +1,60 @@
+import threading
+from time import perf_counter
+
+from ibm_cloud_sdk_core import ApiException
+from metrics import ApiMetrics
+from report import record_retry
+
+# Client methods that go to the API; everything else (set_service_url,
+# configuration) is passed through untouched.
+API_METHOD_PREFIXES = ('list_', 'get_', 'delete_', 'create_', 'update_')
+
+
+class InstrumentedService:
+    """
+    Proxy around an IBM Cloud SDK client recording every API call in ApiMetrics.
+
+    Calls are timed and labelled with the method name, the region the client
+    talks to and the HTTP status. A delete of a resource id this client
+    already tried to delete is counted as a retry.
+    """
+
+    def __init__(self, service, region='global'):
+        self._service = service
+        self._region = region
+        self._deleted = set()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attr = getattr(self._service, name)
+        if not callable(attr) or not name.startswith(API_METHOD_PREFIXES):
+            return attr
+
+        def call(*args, **kwargs):
+            if name.startswith('delete_'):
+                self._track_delete(name, args[0] if args else kwargs.get('id'))
+            start = perf_counter()
+            try:
+                response = attr(*args, **kwargs)
+            except ApiException as e:
+                ApiMetrics.record_call(name, self._region, e.code, perf_counter() - start)
+                raise
+            except Exception:
+                ApiMetrics.record_call(name, self._region, 'error', perf_counter() - start)
+                raise
+            ApiMetrics.record_call(name, self._region, response.get_status_code(), perf_counter() - start)
+            return response
+
+        return call
+
+    def _track_delete(self, name, resource_id):
+        with self._lock:
+            retry = (name, resource_id) in self._deleted
+            self._deleted.add((name, resource_id))
+        if retry:
+            ApiMetrics.record_retry(name, self._region)
+            record_retry(name)
+
+
+def instrument(service, region='global'):
+    return InstrumentedService(service, region)
@@ -0,0 +1,143 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from log_context import submit_with_context
+
+# Above this many instances to re-read, listing the resource groups again
+# (100 instances per page) takes fewer calls than one GET per instance.
+RELIST_THRESHOLD = 100
+
+
+class Resource:
+    """The handful of fields the cleaner needs from an IBM Cloud resource."""
+
+    __slots__ = ('id', 'status', 'vpc_id', 'resource_group', 'region', 'refs')
+
+    def __init__(self, id, status=None, vpc_id=None, resource_group=None, region=None, refs=()):
+        self.id = id
+        self.status = status
+        self.vpc_id = vpc_id
+        self.resource_group = resource_group
+        self.region = region
+        self.refs = refs
+
+    @classmethod
+    def from_api(cls, item, region=None, status_key='status', refs_key=None):
+        vpc = item.get('vpc') or {}
+        resource_group = item.get('resource_group') or {}
+        refs = tuple(ref['id'] for ref in item.get(refs_key) or ()) if refs_key else ()
+        return cls(item['id'],
+                   item.get(status_key) if status_key else None,
+                   vpc.get('id'),
+                   resource_group.get('id'),
+                   region,
+                   refs)
+
+    def __repr__(self):
+        return f"Resource({self.id!r}, status={self.status!r})"
+
+
+class RegionInventory:
+    """
+    Snapshot of the resources in one region, built in a single parallel pass.
+
+    listers maps a resource type to (list_function, status_key, refs_key),
+    where list_function returns an iterable of API dicts. Types whose
+    listing failed raise the original error from get() and refresh(), so
+    only the steps depending on them fail.
+    """
+
+    def __init__(self, region, listers):
+        self.region = region
+        self.listers = listers
+        self._resources = {}
+        self._errors = {}
+
+    def _list(self, name):
+        list_function, status_key, refs_key = self.listers[name]
+        return [Resource.from_api(item, self.region, status_key, refs_key) for item in list_function()]
+
+    def load(self, max_workers=8):
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            listings = {name: submit_with_context(executor, self._list, name) for name in self.listers}
+        for name, listing in listings.items():
+            try:
+                self._resources[name] = listing.result()
+            except Exception as e:
+                logging.warning(f"Listing {name} failed with {e}")
+                self._errors[name] = e
+        return self
+
+    def get(self, name):
+        if name in self._errors:
+            raise self._errors[name]
+        return self._resources[name]
+
+    def refresh(self, name):
+        """Re-list a single resource type and return its records."""
+        self._resources[name] = self._list(name)
+        self._errors.pop(name, None)
+        return self._resources[name]
+
+    def snapshot(self):
+        """Ids per resource type, for the types whose last listing succeeded."""
+        return {name: {record.id for record in records} for name, records in self._resources.items()
+                if name not in self._errors}
+
+    def non_empty_types(self):
+        return sorted(set(self._errors) | {name for name, records in self._resources.items() if records})
+
+    def is_empty(self):
+        return not self.non_empty_types()
+
+
+class ResourceInstanceInventory:
+    """
+    Resource controller instances of an account.
+
+    The account-wide listing can be started in the background with start()
+    so it overlaps with other work. recheck() then only re-reads the cached
+    instances it is asked about and forgets the ones that are gone, so each
+    poll only pays for the instances still pending.
+    """
+
+    def __init__(self, list_instances, get_instance):
+        self.list_instances = list_instances
+        self.get_instance = get_instance
+        self._listing = None
+        self._instances = None
+
+    def start(self, executor):
+        self._listing = submit_with_context(executor, lambda: list(self.list_instances()))
+        return self
+
+    def get(self):
+        if self._instances is None:
+            self._instances = self._listing.result() if self._listing else list(self.list_instances())
+        return list(self._instances)
+
+    def recheck(self, select=None, max_workers=8):
+        """
+        Re-read the cached instances matching select (all by default) and
+        return every cached instance not yet removed.
+
+        Up to RELIST_THRESHOLD instances are fetched one by one; beyond that
+        the resource groups are listed again and only the cached ids are
+        kept, so instances created since are not picked up.
+        """
+        instances = self.get()
+        stale_ids = {instance['id'] for instance in instances if select is None or select(instance)}
+        if not stale_ids:
+            return instances
+        if len(stale_ids) > RELIST_THRESHOLD:
+            current = [instance for instance in self.list_instances() if instance['id'] in stale_ids]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                checks = [submit_with_context(executor, self.get_instance, instance_id) for instance_id in stale_ids]
+            current = [check.result() for check in checks]
+        current = {instance['id']: instance for instance in current
+                   if instance and instance.get('state') != 'removed'}
+        self._instances = [current.get(instance['id']) if instance['id'] in stale_ids else instance
+                           for instance in instances]
+        self._instances = [instance for instance in self._instances if instance]
+        return list(self._instances)
@@ -0,0 +1,28 @@
+import contextvars
+import logging
+import sys
+
+LOG_FORMAT = '%(asctime)s %(module)s %(levelname)s [%(account)s] %(message)s'
+
+# Name of the account the current thread or task is working on, so log
+# lines of accounts processed in parallel can be told apart.
+account_context = contextvars.ContextVar('account', default='-')
+
+
+class AccountContextFilter(logging.Filter):
+    def filter(self, record):
+        record.account = account_context.get()
+        return True
+
+
+def configure_logging(level=logging.INFO):
+    logging.basicConfig(stream=sys.stdout, level=level,
+                        format=LOG_FORMAT, datefmt='%Y-%m-%dT%H:%M:%S%z')
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(AccountContextFilter())
+
+
+def submit_with_context(executor, fn, *args, **kwargs):
+    """Submit fn to executor so it runs with a copy of the caller's context."""
+    context = contextvars.copy_context()
+    return executor.submit(context.run, fn, *args, **kwargs)
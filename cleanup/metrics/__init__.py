@@ -1,3 +1,4 @@
 from .app_metrics import AppMetrics # noqa F401
 from .ibm_update_billing import UpdateBillingMetrics # noqa F401
 from .ibm_cleanup_sandbox import CleanUpSandboxMetrics # noqa F401
+from .ibm_api import ApiMetrics # noqa F401
@@ -1,6 +1,8 @@
+import atexit
 import logging
 import os
-from functools import wraps
+import threading
+from functools import partial, wraps
 
 from prometheus_client import REGISTRY, Summary, push_to_gateway
 
@@ -14,13 +16,28 @@ class AppMetrics:
         ['method_name']
         )
 
+    # Pushgateway jobs with changes that have not been pushed yet. Pushing
+    # happens on flush_metrics(), from the publisher thread and at exit.
+    _pending_jobs = set()
+    _pending_lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _publisher = None
+    _publisher_stop = threading.Event()
+
     @classmethod
-    def record_request_latency(cls, func):
-        """Decorator to measure and record the time taken by a function, with method labeling."""
+    def record_request_latency(cls, func=None, method_name=None):
+        """
+        Decorator to measure and record the time taken by a function, with method labeling.
+
+        The label is the function name unless method_name is given, e.g.
+        @record_request_latency(method_name='create_record').
+        """
+        if func is None:
+            return partial(cls.record_request_latency, method_name=method_name)
+
         @wraps(func)
         def wrapper(*args, **kwargs):
-            method_name = func.__name__
-            with cls.request_latency_seconds.labels(method_name=method_name).time():
+            with cls.request_latency_seconds.labels(method_name=method_name or func.__name__).time():
                 result = func(*args, **kwargs)
             cls.push_metrics()  # Optionally push metrics after recording
             return result
@@ -28,14 +45,52 @@ class AppMetrics:
 
     @classmethod
     def push_metrics(cls):
-        """Pushes all metrics to the configured Pushgateway."""
+        """Marks the metrics of this job for the next push to the Pushgateway. Never blocks on the network."""
+        with AppMetrics._pending_lock:
+            AppMetrics._pending_jobs.add(cls.__name__)
+
+    @classmethod
+    def flush_metrics(cls, timeout=10):
+        """Pushes all metrics of every job with pending changes to the configured Pushgateway."""
         pushgateway_url = os.getenv("PUSH_GATEWAY_URL", 'http://localhost:9091')
-        if not pushgateway_url:
-            logger.warning("PUSH_GATEWAY_URL not set. Skipping push to gateway.")
+        with AppMetrics._flush_lock:
+            with AppMetrics._pending_lock:
+                jobs = set(AppMetrics._pending_jobs)
+                AppMetrics._pending_jobs.clear()
+            if not jobs:
+                return
+            if not pushgateway_url:
+                logger.warning("PUSH_GATEWAY_URL not set. Skipping push to gateway.")
+                return
+            for job_name in sorted(jobs):
+                try:
+                    push_to_gateway(pushgateway_url, job=job_name, registry=REGISTRY, timeout=timeout)
+                except Exception as e:
+                    logger.error(f"Failed to push metrics: {str(e)}")
+                    print(f"Failed to push metrics: {str(e)}")
+
+    @classmethod
+    def start_publisher(cls, interval=None):
+        """Starts a background thread flushing pending metrics every interval seconds (PUSH_INTERVAL_SECONDS)."""
+        if interval is None:
+            interval = float(os.getenv("PUSH_INTERVAL_SECONDS", 0))
+        if interval <= 0 or AppMetrics._publisher is not None:
             return
-        job_name = cls.__name__
-        try:
-            push_to_gateway(pushgateway_url, job=job_name, registry=REGISTRY, timeout=10)
-        except Exception as e:
-            logger.error(f"Failed to push metrics: {str(e)}")
-            print(f"Failed to push metrics: {str(e)}")
+
+        def publish():
+            while not AppMetrics._publisher_stop.wait(interval):
+                AppMetrics.flush_metrics()
+
+        AppMetrics._publisher = threading.Thread(target=publish, name='metrics-publisher', daemon=True)
+        AppMetrics._publisher.start()
+
+    @classmethod
+    def stop_publisher(cls):
+        """Stops the background publisher and pushes whatever is still pending."""
+        AppMetrics._publisher_stop.set()
+        AppMetrics.flush_metrics()
+
+
+# atexit also runs when the process exits because of an unhandled
+# exception, so metrics recorded before the failure are not lost.
+atexit.register(AppMetrics.flush_metrics)
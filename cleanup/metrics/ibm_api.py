@@ -0,0 +1,46 @@
+from __future__ import annotations
+
+from prometheus_client import Counter, Histogram
+
+from metrics import AppMetrics
+
+
+class ApiMetrics(AppMetrics):
+    """
+    Per-call metrics of the IBM Cloud and SAA APIs.
+
+    These are recorded from any process and go out with the job that
+    process pushes, so nothing here marks a job of its own.
+    """
+
+    ibm_api_request_seconds = Histogram(
+        'ibm_api_request_seconds',
+        'Time spent in a single IBM Cloud or SAA API call',
+        ['operation', 'region', 'status'],
+        buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    )
+
+    ibm_api_errors_total = Counter(
+        'ibm_api_errors_total',
+        'Total number of API calls that failed, by status class',
+        ['operation', 'region', 'status_class']
+    )
+
+    ibm_api_retries_total = Counter(
+        'ibm_api_retries_total',
+        'Total number of API calls repeating an earlier call',
+        ['operation', 'region']
+    )
+
+    @classmethod
+    def record_call(cls, operation, region, status, seconds):
+        cls.ibm_api_request_seconds.labels(operation=operation, region=region, status=str(status)).observe(seconds)
+        if not isinstance(status, int):
+            cls.ibm_api_errors_total.labels(operation=operation, region=region, status_class='network').inc()
+        elif status >= 400:
+            cls.ibm_api_errors_total.labels(operation=operation, region=region,
+                                            status_class=f"{status // 100}xx").inc()
+
+    @classmethod
+    def record_retry(cls, operation, region, count=1):
+        cls.ibm_api_retries_total.labels(operation=operation, region=region).inc(count)
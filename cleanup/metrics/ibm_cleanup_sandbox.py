@@ -1,6 +1,8 @@
 from __future__ import annotations
 
-from prometheus_client import Gauge
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, Summary
 
 from metrics import AppMetrics
 
@@ -30,6 +32,81 @@ class CleanUpSandboxMetrics(AppMetrics):
         ['account', 'cloud_provider', 'instance', 'job_name']
     )
 
+    ibm_clean_region_decisions = Counter(
+        'ibm_clean_region_decisions',
+        'Regions skipped as empty or cleaned',
+        ['region', 'decision', 'instance']
+    )
+
+    ibm_verify_stage_seconds = Summary(
+        'ibm_verify_stage_seconds',
+        'Time spent in each stage of account verification',
+        ['stage', 'instance']
+    )
+
+    ibm_clean_phase_seconds = Gauge(
+        'ibm_clean_phase_seconds',
+        'Wall time of each phase of the last cleanup of an account',
+        ['account', 'phase', 'instance']
+    )
+
+    ibm_clean_region_seconds = Gauge(
+        'ibm_clean_region_seconds',
+        'Wall time of each region in the last cleanup of an account',
+        ['account', 'region', 'instance']
+    )
+
+    ibm_clean_resource_type_seconds = Histogram(
+        'ibm_clean_resource_type_seconds',
+        'Time spent on a resource type during one account cleanup, summed over regions',
+        ['resource_type', 'instance'],
+        buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800)
+    )
+
+    ibm_clean_wait_seconds = Histogram(
+        'ibm_clean_wait_seconds',
+        'Time spent waiting for deletions of a resource type during one account cleanup',
+        ['resource_type', 'instance'],
+        buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800)
+    )
+
+    ibm_clean_resources = Gauge(
+        'ibm_clean_resources',
+        'Resources deleted, retried or left over in the last cleanup of an account',
+        ['account', 'resource_type', 'outcome', 'instance']
+    )
+
+    @classmethod
+    def push_cleanup_report(cls, report, instance='check_cleanup'):
+        account = report['account'] or ''
+        cls.ibm_clean_phase_seconds.labels(account=account, phase='total', instance=instance).set(
+            report['total_seconds'])
+        for phase, seconds in report['phases'].items():
+            cls.ibm_clean_phase_seconds.labels(account=account, phase=phase, instance=instance).set(seconds)
+        for region, seconds in report['regions'].items():
+            cls.ibm_clean_region_seconds.labels(account=account, region=region, instance=instance).set(seconds)
+        for resource_type, seconds in report['resource_types'].items():
+            cls.ibm_clean_resource_type_seconds.labels(resource_type=resource_type, instance=instance).observe(seconds)
+        for resource_type, seconds in report['waits'].items():
+            cls.ibm_clean_wait_seconds.labels(resource_type=resource_type, instance=instance).observe(seconds)
+        for outcome, counts in report['resources'].items():
+            for resource_type, count in counts.items():
+                cls.ibm_clean_resources.labels(account=account, resource_type=resource_type, outcome=outcome,
+                                               instance=instance).set(count)
+        cls.push_metrics()
+
+    @classmethod
+    @contextmanager
+    def time_verify_stage(cls, stage, instance='verify_account'):
+        with cls.ibm_verify_stage_seconds.labels(stage=stage, instance=instance).time():
+            yield
+        cls.push_metrics()
+
+    @classmethod
+    def push_region_decision(cls, region, decision, instance='check_cleanup'):
+        cls.ibm_clean_region_decisions.labels(region=region, decision=decision, instance=instance).inc()
+        cls.push_metrics()
+
     @classmethod
     def push_clean_metrics(cls, metric_name, value, job_name, labels=None, instance='check_cleanup'):
         if labels and isinstance(labels, dict):
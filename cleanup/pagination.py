@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+from log_context import submit_with_context
+
+
+def next_start(result):
+    """Return the start token of the next VPC or resource controller page, if any."""
+    next_page = result.get('next')
+    if isinstance(next_page, dict):
+        href = next_page.get('href')
+    else:
+        href = result.get('next_url')
+    if not href:
+        return None
+    return parse_qs(urlparse(href).query).get('start', [None])[0]
+
+
+def next_offset(result):
+    """Return the offset of the next page of an enterprise usage report, if any."""
+    return (result.get('next') or {}).get('offset')
+
+
+def paginate(list_method, result_key, limit=100, next_token=next_start, token_arg='start', **kwargs):
+    """
+    Lazily yield every item of a paginated IBM Cloud collection.
+
+    The request for the next page is sent before the items of the current
+    page are handed out, so callers can act on page 1 while page 2 is in
+    flight.
+    """
+    def fetch(token):
+        args = dict(kwargs)
+        if limit:
+            args['limit'] = limit
+        if token:
+            args[token_arg] = token
+        return list_method(**args).get_result()
+
+    page = fetch(None)
+    # Only one page is ever in flight, so each paginator gets a single
+    # thread of its own, started once there is a second page and shut
+    # down when the caller is done with the collection.
+    prefetcher = None
+    try:
+        while page is not None:
+            token = next_token(page)
+            upcoming = None
+            if token:
+                prefetcher = prefetcher or ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+                upcoming = submit_with_context(prefetcher, fetch, token)
+            yield from page.get(result_key) or []
+            page = upcoming.result() if upcoming else None
+    finally:
+        if prefetcher:
+            prefetcher.shutdown(wait=False)
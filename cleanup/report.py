@@ -0,0 +1,151 @@
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+from metrics import CleanUpSandboxMetrics
+
+# The report of the account being cleaned and the step (resource type)
+# being run. Like the account log context, both follow work submitted
+# with submit_with_context.
+report_context = ContextVar('report', default=None)
+step_context = ContextVar('step', default=None)
+
+
+class CleanupReport:
+    """
+    Timings and resource counts of one account cleanup.
+
+    Covers wall time per phase and per region, time per resource type
+    (summed over regions), time spent waiting on deletions per resource
+    type and the number of resources deleted, retried or left over.
+    """
+
+    def __init__(self, account):
+        self.account = account
+        self.phases = {}
+        self.regions = {}
+        self.steps = {}
+        self.waits = {}
+        self.resources = {}
+        self._started = perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.phases[name] = self.phases.get(name, 0) + perf_counter() - start
+
+    @contextmanager
+    def region(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.regions[name] = perf_counter() - start
+
+    def record_step(self, resource_type, seconds):
+        with self._lock:
+            self.steps[resource_type] = self.steps.get(resource_type, 0) + seconds
+
+    def record_wait(self, resource_type, seconds):
+        with self._lock:
+            self.waits[resource_type] = self.waits.get(resource_type, 0) + seconds
+
+    def record_resources(self, outcome, resource_type, count):
+        with self._lock:
+            counts = self.resources.setdefault(outcome, {})
+            counts[resource_type] = counts.get(resource_type, 0) + count
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'account': self.account,
+                'total_seconds': round(perf_counter() - self._started, 3),
+                'phases': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+                'regions': {name: round(seconds, 3) for name, seconds in self.regions.items()},
+                'resource_types': {name: round(seconds, 3) for name, seconds in self.steps.items()},
+                'waits': {name: round(seconds, 3) for name, seconds in self.waits.items()},
+                'resources': {outcome: dict(counts) for outcome, counts in self.resources.items()},
+            }
+
+    def publish(self):
+        """Log the report as one JSON record and export it through CleanUpSandboxMetrics."""
+        data = self.to_dict()
+        logging.info(f"Cleanup report: {json.dumps(data, sort_keys=True)}")
+        CleanUpSandboxMetrics.push_cleanup_report(data)
+        return data
+
+
+@contextmanager
+def reporting(account):
+    report = CleanupReport(account)
+    token = report_context.set(report)
+    try:
+        yield report
+    finally:
+        report_context.reset(token)
+
+
+@contextmanager
+def phase(name):
+    report = report_context.get()
+    if report is None:
+        yield
+        return
+    with report.phase(name):
+        yield
+
+
+@contextmanager
+def region(name):
+    report = report_context.get()
+    if report is None:
+        yield
+        return
+    with report.region(name):
+        yield
+
+
+@contextmanager
+def step(resource_type):
+    """Time a block as work on resource_type and attribute waits and retries inside it to that type."""
+    token = step_context.set(resource_type)
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        step_context.reset(token)
+        report = report_context.get()
+        if report:
+            report.record_step(resource_type, perf_counter() - start)
+
+
+def timed_step(resource_type, func):
+    def run():
+        with step(resource_type):
+            return func()
+    return run
+
+
+def record_wait(seconds):
+    report = report_context.get()
+    if report and seconds:
+        report.record_wait(step_context.get() or 'other', seconds)
+
+
+def record_resources(outcome, resource_type, count=1):
+    report = report_context.get()
+    if report and count:
+        report.record_resources(outcome, resource_type, count)
+
+
+def record_retry(operation):
+    record_resources('retried', step_context.get() or operation)
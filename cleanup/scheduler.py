@@ -0,0 +1,71 @@
+import logging
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from log_context import submit_with_context
+
+
+def validate_graph(dependencies):
+    """Raise ValueError if the graph references unknown steps or has a cycle."""
+    for name, prerequisites in dependencies.items():
+        for prerequisite in prerequisites:
+            if prerequisite not in dependencies:
+                raise ValueError(f"Step {name} depends on unknown step {prerequisite}")
+
+    visiting = set()
+    visited = set()
+
+    def visit(name):
+        if name in visited:
+            return
+        if name in visiting:
+            raise ValueError(f"Dependency cycle detected at step {name}")
+        visiting.add(name)
+        for prerequisite in dependencies[name]:
+            visit(prerequisite)
+        visiting.discard(name)
+        visited.add(name)
+
+    for name in dependencies:
+        visit(name)
+
+
+def run_graph(steps, dependencies, max_workers=4):
+    """
+    Run every step as soon as all of its prerequisites have finished.
+
+    steps maps a step name to a callable taking no arguments and
+    dependencies maps the same names to the names they wait on. A step
+    whose prerequisite failed is skipped, as are its own dependents.
+    Returns a dict of step name to 'done', 'skipped' or 'failed: <error>'.
+    """
+    validate_graph(dependencies)
+    results = {}
+    pending = set(steps)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        while pending or running:
+            for name in sorted(pending):
+                prerequisites = [p for p in dependencies.get(name, ()) if p in steps]
+                if any(p in results and results[p] != 'done' for p in prerequisites):
+                    logging.warning(f"Skipping {name} because a prerequisite did not finish.")
+                    results[name] = 'skipped'
+                    pending.discard(name)
+                elif all(results.get(p) == 'done' for p in prerequisites):
+                    running[submit_with_context(executor, steps[name])] = name
+                    pending.discard(name)
+
+            if not running:
+                continue
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                    results[name] = 'done'
+                except Exception as e:
+                    logging.error(f"Step {name} failed with {e}")
+                    results[name] = f"failed: {e}"
+
+    return results
@@ -0,0 +1,70 @@
+import hashlib
+import threading
+from time import time
+
+import jwt
+
+# Refresh a token this many seconds before it actually expires.
+REFRESH_MARGIN = 120
+
+
+def token_expiry(response):
+    """Return the epoch time a token response expires at, or None if unknown."""
+    if response.get('expiration'):
+        return float(response['expiration'])
+    if response.get('expires_in'):
+        return time() + float(response['expires_in'])
+    try:
+        claims = jwt.decode(response['access_token'], options={'verify_signature': False})
+    except jwt.PyJWTError:
+        return None
+    return claims.get('exp')
+
+
+class TokenCache:
+    """Thread-safe cache of bearer tokens keyed by token endpoint and API key."""
+
+    def __init__(self, refresh_margin=REFRESH_MARGIN):
+        self.refresh_margin = refresh_margin
+        self._tokens = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token_url, api_key):
+        return token_url, hashlib.sha256(api_key.encode('utf-8')).hexdigest()
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._locks.setdefault(key, threading.Lock())
+
+    def get_token(self, token_url, api_key, fetch):
+        """
+        Return a cached token for api_key, calling fetch() for a new one when needed.
+
+        fetch must return the decoded token response. Responses without any
+        expiry information are not cached.
+        """
+        key = self._key(token_url, api_key)
+        # One lock per credential so concurrent callers wait for a single
+        # refresh instead of all requesting their own token.
+        with self._key_lock(key):
+            cached = self._tokens.get(key)
+            if cached and cached[1] - self.refresh_margin > time():
+                return cached[0]
+
+            response = fetch()
+            token = response['access_token']
+            expires_at = token_expiry(response)
+            if expires_at:
+                self._tokens[key] = (token, expires_at)
+            else:
+                self._tokens.pop(key, None)
+            return token
+
+    def invalidate(self, token_url, api_key):
+        with self._lock:
+            self._tokens.pop(self._key(token_url, api_key), None)
+
+
+TOKEN_CACHE = TokenCache()
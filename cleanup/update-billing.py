@@ -1,16 +1,46 @@
 import logging
 import os
-from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from itertools import islice
 
 import boto3
+from billing import BillingWriter, get_cost_index
+from botocore.config import Config
+from dynamodb import MAX_POOL_CONNECTIONS
 from ibm_cloud_sdk_core.api_exception import ApiException
 from ibm_cloud_sdk_core.authenticators import IAMAuthenticator
 from ibm_platform_services.enterprise_management_v1 import EnterpriseManagementV1
 from ibm_platform_services.enterprise_usage_reports_v1 import EnterpriseUsageReportsV1
+from instrumentation import instrument
 from metrics import UpdateBillingMetrics
+from pagination import next_offset, paginate
 
 logger = logging.getLogger()
 
+# Optional endpoint overrides, e.g. to run the job against local stand-ins
+# of IAM, the enterprise APIs and DynamoDB.
+IAM_URL = os.environ.get('IBM_IAM_URL')
+ENTERPRISE_MANAGEMENT_URL = os.environ.get('IBM_ENTERPRISE_MANAGEMENT_URL')
+ENTERPRISE_USAGE_REPORTS_URL = os.environ.get('IBM_ENTERPRISE_USAGE_REPORTS_URL')
+DYNAMODB_ENDPOINT_URL = os.environ.get('DYNAMODB_ENDPOINT_URL')
+# Usage report entries requested per page and handed to the writer together.
+REPORT_PAGE_SIZE = 100
+
+
+def new_account_manager(authenticator):
+    account_manager = EnterpriseManagementV1(authenticator=authenticator)
+    if ENTERPRISE_MANAGEMENT_URL:
+        account_manager.set_service_url(ENTERPRISE_MANAGEMENT_URL)
+    return instrument(account_manager)
+
+
+def new_usage_reporter(authenticator):
+    usage_reporter = EnterpriseUsageReportsV1(authenticator=authenticator)
+    if ENTERPRISE_USAGE_REPORTS_URL:
+        usage_reporter.set_service_url(ENTERPRISE_USAGE_REPORTS_URL)
+    return instrument(usage_reporter)
+
 
 def get_account_group_billing(usage_reporter, account_groups, billing_month):
     for ag in account_groups:
@@ -21,35 +51,35 @@ def get_account_group_billing(usage_reporter, account_groups, billing_month):
         print()
 
 
-@UpdateBillingMetrics.record_request_latency
-def create_record(db, billing_table, billing_ttl, **kwargs):
-    response = db.put_item(
-        TableName=billing_table,
-        Item={
-            "account_name": {
-                "S": kwargs['account_name']
-            },
-            "cloud_provider": {
-                "S": kwargs['cloud_provider']
-            },
-            "account_id": {
-                "S": kwargs['account_id']
-            },
-            "billing_month": {
-                "S": kwargs['billing_month']
-            },
-            "billable_cost": {
-                "N": str(kwargs['billable_cost'])
-            },
-            "timestamp": {
-                "S": datetime.now(timezone.utc).isoformat("T", "minutes")
-            },
-            "ttl": {
-                "N": str(billing_ttl.timestamp())
-            }
-        }
-    )
-    return response
+def get_usage_reports(usage_reporter, account_group, billing_month):
+    """Stream every usage report entry of an account group, following the report's next offset."""
+    return paginate(usage_reporter.get_resource_usage_report, 'reports', limit=REPORT_PAGE_SIZE,
+                    next_token=next_offset, token_arg='offset',
+                    account_group_id=account_group['id'], month=billing_month, children=True)
+
+
+def collect_account_group(usage_reporter, account_group, billing_month, writer):
+    logger.info(f"Getting billing for account group {account_group['name']}")
+    try:
+        reports = get_usage_reports(usage_reporter, account_group, billing_month)
+        # A page at a time, so in delta mode the last costs of its accounts
+        # are looked up together.
+        while True:
+            page = list(islice(reports, REPORT_PAGE_SIZE))
+            if not page:
+                break
+            entries = []
+            for account in page:
+                logger.info(f"Updating billing for account {account['entity_name']}")
+
+                UpdateBillingMetrics.push_billing_account_total()
+
+                entries.append((account['entity_name'], account['entity_id'], account['billable_cost']))
+            writer.add_many(entries)
+    except ApiException:
+        logger.error(f"Failed to get billing for account group {account_group['name']}")
+        print(f"Failed to get billing for account group {account_group['name']}. Skipping.")
+        UpdateBillingMetrics.push_billing_account_failure_total()
 
 
 def main():
@@ -79,60 +109,45 @@ def main():
         aws_secret_access_key=aws_secret_access_key,
         region_name=aws_region
         )
-    db = aws_session.client('dynamodb')
+    db = aws_session.client('dynamodb', endpoint_url=DYNAMODB_ENDPOINT_URL,
+                            config=Config(max_pool_connections=MAX_POOL_CONNECTIONS))
 
     billing_month = datetime.now().strftime('%Y-%m')
 
-    authenticator = IAMAuthenticator(enterprice_api_key)
+    authenticator = IAMAuthenticator(enterprice_api_key, url=IAM_URL)
 
-    account_manager = EnterpriseManagementV1(authenticator=authenticator)
-    usage_reporter = EnterpriseUsageReportsV1(authenticator=authenticator)
+    account_manager = new_account_manager(authenticator)
+    usage_reporter = new_usage_reporter(authenticator)
 
     account_groups = account_manager.list_account_groups(
         enterprise_id=enterprice_account_id).get_result()['resources']
 
-    for ag in account_groups:
-        logger.info(f"Getting billing for account group {ag['name']}")
-        billing_ttl = datetime.now() + timedelta(days=61)
+    billing_ttl = datetime.now() + timedelta(days=61)
+    writer = BillingWriter(db, billing_table, billing_ttl, billing_month, cloud_provider,
+                           get_cost_index(db, billing_table))
+
+    # Account groups are fetched concurrently; their entries go straight
+    # to the writer, which sends a batch whenever one is full.
+    max_workers = int(os.environ.get('BILLING_MAX_WORKERS', 8))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(collect_account_group, usage_reporter, ag, billing_month, writer): ag['name']
+                   for ag in account_groups}
+    for future, account_group_name in futures.items():
         try:
-            usage = usage_reporter.get_resource_usage_report(account_group_id=ag['id'],
-                                                             month=billing_month,
-                                                             children=True,
-                                                             limit=100
-                                                             ).get_result()['reports']
-        except ApiException:
-            logger.error(f"Failed to get billing for account group {ag['name']}")
-            print(f"Failed to get billing for account group {ag['name']}. Skipping.")
+            future.result()
+        except Exception as e:
+            logger.error(f"Collecting billing for account group {account_group_name} failed with {e}")
             UpdateBillingMetrics.push_billing_account_failure_total()
-            continue
-
-        for account in usage:
-            logger.info(f"Updating billing for account {account['entity_name']}")
-
-            UpdateBillingMetrics.push_billing_account_total()
-
-            response = create_record(db,
-                                     billing_table,
-                                     billing_ttl,
-                                     account_name=account['entity_name'],
-                                     account_id=account['entity_id'],
-                                     billable_cost=account['billable_cost'],
-                                     billing_month=billing_month,
-                                     cloud_provider=cloud_provider
-                                     )
-            if response['ResponseMetadata']['HTTPStatusCode'] == 200:
-                UpdateBillingMetrics.push_billing_account_success(account['entity_name'])
-                print(
-                    f"Account {account['entity_name']} updated successfully.")
-            else:
-                logger.error(
-                    f"Account {account['entity_name']} could not be updated.")
-                print(
-                    f"Account {account['entity_name']} could not be updated.")
-                UpdateBillingMetrics.push_billing_account_failures(account['entity_name'])
-                UpdateBillingMetrics.push_billing_account_failure_total()
+
+    writer.flush()
+    logger.info(f"Billing updated for {len(writer.succeeded)} accounts, {len(writer.failed)} failed, "
+                f"{len(writer.unchanged)} unchanged.")
 
 
 if __name__ == '__main__':
     UpdateBillingMetrics.push_metrics()
-    main()
+    UpdateBillingMetrics.start_publisher()
+    try:
+        main()
+    finally:
+        UpdateBillingMetrics.stop_publisher()
@@ -0,0 +1,99 @@
+import logging
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import dynamodb
+from log_context import submit_with_context
+
+# Costs of the two billing points compared by verification; None when the
+# billing job wrote no record at or within LOOKBACK before that point.
+Usage = namedtuple('Usage', ['previous_cost', 'current_cost'])
+
+# How far before the previous billing point a record may be and still count
+# for it: the billing delta-mode heartbeat plus one billing interval.
+LOOKBACK = timedelta(hours=float(os.environ.get('BILLING_HEARTBEAT_HOURS', 24)) + 1)
+
+
+def usage_prefixes(now=None):
+    """Timestamp prefixes of the previous (minute) and current (hour) billing points."""
+    now = now or datetime.now(timezone.utc)
+    previous_usage_time = (now - timedelta(hours=1, minutes=20)).strftime('%Y-%m-%dT%H:%M')
+    current_usage_time = (now - timedelta(minutes=20)).strftime('%Y-%m-%dT%H')
+    return previous_usage_time, current_usage_time
+
+
+def latest_cost(items, end):
+    """Cost of the most recent record at or before end; items are sorted newest first."""
+    for item in items:
+        if item['timestamp']['S'] <= end:
+            return float(item['billable_cost']['N'])
+    return None
+
+
+def get_usage(account_name, now=None, db=None, billing_table=None, page_size=5):
+    """
+    Fetch both billing points of an account with a single descending range query.
+
+    Each point is the most recent record at or before it, so an account
+    whose unchanged cost was not rewritten (billing delta mode) still
+    resolves to its last record within LOOKBACK.
+    """
+    db = db or dynamodb.get_client()
+    billing_table = billing_table or os.environ.get('IBM_USAGE_DB')
+    now = now or datetime.now(timezone.utc)
+    previous_usage_time, current_usage_time = usage_prefixes(now)
+    # '~' sorts after every character of an ISO timestamp, so a prefix
+    # followed by it ends after the last record the prefix matches.
+    previous_end = previous_usage_time + '~'
+    current_end = current_usage_time + '~'
+    start = (now - timedelta(hours=1, minutes=20) - LOOKBACK).strftime('%Y-%m-%dT%H:%M')
+    query = dict(
+        TableName=billing_table,
+        KeyConditionExpression='account_name = :an AND #t BETWEEN :start AND :end',
+        ExpressionAttributeValues={
+            ":an": {
+                "S": account_name
+            },
+            ":start": {
+                "S": start
+            },
+            ":end": {
+                "S": current_end
+            }
+        },
+        ExpressionAttributeNames={
+            "#t": "timestamp"
+        },
+        ProjectionExpression='billable_cost, #t',
+        ScanIndexForward=False,
+        Limit=page_size
+    )
+    # Newest first: stop paging as soon as a record old enough for the
+    # previous point has been seen.
+    items = []
+    while True:
+        response = db.query(**query)
+        items.extend(response['Items'])
+        if any(item['timestamp']['S'] <= previous_end for item in items) or 'LastEvaluatedKey' not in response:
+            break
+        query['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return Usage(latest_cost(items, previous_end), latest_cost(items, current_end))
+
+
+def get_usages(account_names, now=None, max_workers=16):
+    """Look up the usage of many accounts at once, sharing one client. Failed lookups are logged and left out."""
+    now = now or datetime.now(timezone.utc)
+    db = dynamodb.get_client()
+    billing_table = os.environ.get('IBM_USAGE_DB')
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        lookups = {account_name: submit_with_context(executor, get_usage, account_name, now, db, billing_table)
+                   for account_name in account_names}
+    usages = {}
+    for account_name, lookup in lookups.items():
+        try:
+            usages[account_name] = lookup.result()
+        except Exception as e:
+            logging.error(f"Usage lookup for {account_name} failed with {e}")
+    return usages
@@ -0,0 +1,52 @@
+import random
+from time import monotonic, sleep
+
+from report import record_wait
+
+# States in which IBM Cloud has accepted a delete and is working on it
+# (VPC uses 'deleting', volumes 'pending_deletion', load balancers
+# 'delete_pending' and the resource controller 'pending_removal').
+DELETING_STATES = frozenset({'deleting', 'pending_deletion', 'delete_pending', 'pending_removal'})
+
+
+def is_deleting(resource, status_key='status'):
+    """Works on raw API dicts and on inventory records, which carry a normalized status."""
+    if status_key is None:
+        return False
+    if isinstance(resource, dict):
+        return resource.get(status_key) in DELETING_STATES
+    return getattr(resource, 'status', None) in DELETING_STATES
+
+
+def backoff_delays(deadline, initial=2, factor=2, max_delay=30):
+    """Yield jittered, exponentially growing delays until deadline seconds have passed."""
+    start = monotonic()
+    delay = initial
+    while True:
+        remaining = deadline - (monotonic() - start)
+        if remaining <= 0:
+            return
+        yield min(remaining, random.uniform(delay / 2, delay))
+        delay = min(delay * factor, max_delay)
+
+
+def wait_for_resources(list_resources, deadline, status_key='status', settle_on_deleting=True):
+    """
+    Poll list_resources() until it comes back empty or deadline seconds pass.
+
+    list_resources may return any iterable, including a lazy paginator.
+    When settle_on_deleting is set the wait also ends as soon as every
+    remaining resource reports a deleting state. Returns the last listing.
+    """
+    resources = list(list_resources() or [])
+    slept = 0
+    for delay in backoff_delays(deadline):
+        if not resources:
+            break
+        if settle_on_deleting and all(is_deleting(r, status_key) for r in resources):
+            break
+        sleep(delay)
+        slept += delay
+        resources = list(list_resources() or [])
+    record_wait(slept)
+    return resources